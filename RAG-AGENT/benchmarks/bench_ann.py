@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Recall vs latency of the ANN index tiers against the exact IndexFlatIP baseline.
+
+    python benchmarks/bench_ann.py --vectors 200000 --queries 500
+
+Vectors are synthetic clustered unit vectors with the embedding model's dimension
+(384 for all-MiniLM-L6-v2), or real ones with --npy path/to/vectors.npy.
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import faiss
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from index_factory import build_index, search_index, TIER_FLAT, TIER_HNSW, TIER_IVFPQ  # noqa: E402
+
+
+def clustered_vectors(n, dim, clusters, rng):
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, n)
+    vectors = centers[labels] + 0.35 * rng.standard_normal((n, dim)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def recall_at_k(found, truth):
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def time_search(index, queries, k, **knobs):
+    start = time.perf_counter()
+    for q in queries:
+        search_index(index, q.reshape(1, -1), k, **knobs)
+    per_query_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    _, all_ids = search_index(index, queries, k, **knobs)
+    return per_query_ms, all_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vectors', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=300)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--k-factor', type=int, default=None,
+                        help='IVF-PQ refine candidates per result (default ANN_REFINE_K_FACTOR)')
+    parser.add_argument('--npy', help='Use real normalized vectors from this .npy file instead of synthetic ones')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.npy:
+        data = np.load(args.npy).astype(np.float32)
+        faiss.normalize_L2(data)
+    else:
+        data = clustered_vectors(args.vectors + args.queries, args.dim, clusters=max(16, args.vectors // 500), rng=rng)
+    queries, base = data[:args.queries], data[args.queries:]
+    print(f"Corpus: {len(base)} x {base.shape[1]}, {len(queries)} queries, k={args.k}")
+
+    rows = []
+    for tier, knob_name, knob_values in [
+        (TIER_FLAT, None, [None]),
+        (TIER_HNSW, 'ef_search', [16, 32, 64, 128, 256]),
+        (TIER_IVFPQ, 'nprobe', [1, 4, 16, 64]),
+    ]:
+        start = time.perf_counter()
+        index = build_index(base, tier)
+        build_s = time.perf_counter() - start
+
+        for value in knob_values:
+            knobs = {knob_name: value} if knob_name else {}
+            if tier == TIER_IVFPQ:
+                knobs['k_factor'] = args.k_factor
+            latency_ms, ids = time_search(index, queries, args.k, **knobs)
+            if tier == TIER_FLAT:
+                truth = ids
+            rows.append((tier, f"{knob_name}={value}" if knob_name else "-", build_s,
+                         latency_ms, recall_at_k(ids, truth)))
+
+    print(f"\n{'tier':<7} {'knob':<14} {'build s':>8} {'ms/query':>9} {'recall@' + str(args.k):>9}")
+    for tier, knob, build_s, latency_ms, recall in rows:
+        print(f"{tier:<7} {knob:<14} {build_s:>8.2f} {latency_ms:>9.3f} {recall:>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Throughput, single-query latency and peak RSS of the torch and int8 ONNX Runtime
+embedding backends, plus how closely the ONNX vectors track the torch ones.
+
+    python embedding_backend.py export          # once, builds the ONNX model
+    python benchmarks/bench_embedding_backends.py --threads 1
+
+Each backend runs in its own process so RSS and import cost are measured in isolation.
+The corpus is comprehensive_news_knowledge.txt chunked like an upload.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+import tempfile
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(_HERE))
+
+
+def child(args):
+    import numpy as np
+    from chunker import TokenChunker
+    from embedding_backend import load_embedding_model, OnnxEmbeddingModel
+
+    start = time.perf_counter()
+    model = load_embedding_model(args.model, backend=args.backend)
+    load_s = time.perf_counter() - start
+    if args.backend == 'onnx' and not isinstance(model, OnnxEmbeddingModel):
+        sys.exit("ONNX backend not built; run: python embedding_backend.py export")
+
+    with open(args.corpus, encoding='utf-8') as f:
+        chunks = [c['text'] for c in TokenChunker(model.tokenizer).iter_chunks([f.read()])][:args.chunks]
+    model.encode(chunks[:8], batch_size=8, show_progress_bar=False)
+
+    start = time.perf_counter()
+    vectors = np.asarray(model.encode(chunks, batch_size=32, show_progress_bar=False), dtype=np.float32)
+    throughput = len(chunks) / (time.perf_counter() - start)
+
+    latencies = []
+    for query in chunks[:args.queries]:
+        start = time.perf_counter()
+        model.encode([query[:120]], show_progress_bar=False)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+
+    np.save(args.vectors_out, vectors)
+    print(json.dumps({
+        'load_s': load_s,
+        'chunks_per_s': throughput,
+        'p50_ms': latencies[len(latencies) // 2],
+        'p95_ms': latencies[int(len(latencies) * 0.95)],
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='all-MiniLM-L6-v2')
+    parser.add_argument('--corpus', default=os.path.join(os.path.dirname(_HERE), 'comprehensive_news_knowledge.txt'))
+    parser.add_argument('--chunks', type=int, default=512)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=1, help='Intra-op threads for both backends')
+    parser.add_argument('--backend', help=argparse.SUPPRESS)
+    parser.add_argument('--vectors-out', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.backend:
+        return child(args)
+
+    import numpy as np
+
+    env = dict(os.environ, OMP_NUM_THREADS=str(args.threads), MKL_NUM_THREADS=str(args.threads),
+               ONNX_THREADS=str(args.threads), TOKENIZERS_PARALLELISM='false')
+    results = {}
+    vectors = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in ('torch', 'onnx'):
+            out = os.path.join(tmp, f"{backend}.npy")
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--backend', backend, '--vectors-out', out,
+                 '--model', args.model, '--corpus', args.corpus, '--chunks', str(args.chunks),
+                 '--queries', str(args.queries)],
+                env=env, capture_output=True, text=True, check=True
+            )
+            results[backend] = json.loads(proc.stdout.strip().splitlines()[-1])
+            vectors[backend] = np.load(out)
+
+    print(f"{args.chunks} chunks, {args.queries} single queries, {args.threads} thread(s)\n")
+    print(f"{'backend':<8} {'load s':>7} {'chunks/s':>9} {'p50 ms':>7} {'p95 ms':>7} {'peak RSS MB':>12}")
+    for backend, r in results.items():
+        print(f"{backend:<8} {r['load_s']:>7.2f} {r['chunks_per_s']:>9.1f} {r['p50_ms']:>7.2f} "
+              f"{r['p95_ms']:>7.2f} {r['peak_rss_mb']:>12.0f}")
+
+    cosine = (vectors['torch'] * vectors['onnx']).sum(axis=1) / (
+        np.linalg.norm(vectors['torch'], axis=1) * np.linalg.norm(vectors['onnx'], axis=1))
+    print(f"\nONNX vs torch cosine: mean {cosine.mean():.4f}, min {cosine.min():.4f}")
+
+
+if __name__ == '__main__':
+    main()
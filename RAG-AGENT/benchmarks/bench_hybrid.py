@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Hit-rate and latency of dense-only vs hybrid (BM25 + dense, RRF-fused) document search.
+
+    python benchmarks/bench_hybrid.py --k 3
+
+The corpus is comprehensive_news_knowledge.txt chunked exactly like an upload; the
+queries in fixtures/hybrid_queries.json each name a phrase the retrieved context must
+contain. A query is a hit if any of the top-k chunks contains it.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import faiss
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(_HERE))
+from chunker import TokenChunker  # noqa: E402
+from index_factory import build_index, search_index  # noqa: E402
+from lexical_index import BM25Index, reciprocal_rank_fusion  # noqa: E402
+
+
+def dense_rank(index, query_embedding, candidates):
+    scores, indices = search_index(index, query_embedding, candidates)
+    return [int(idx) for score, idx in zip(scores[0], indices[0]) if idx != -1 and score > 0.10]
+
+
+def hybrid_rank(index, lexical, query, query_embedding, candidates, n_chunks):
+    dense = dense_rank(index, query_embedding, candidates)
+    lexical_ranking = [position for score, position in lexical.search(query, candidates, limit=n_chunks)]
+    return [position for score, position in reciprocal_rank_fusion([dense, lexical_ranking])]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='all-MiniLM-L6-v2')
+    parser.add_argument('--corpus', default=os.path.join(os.path.dirname(_HERE), 'comprehensive_news_knowledge.txt'))
+    parser.add_argument('--queries', default=os.path.join(_HERE, 'fixtures', 'hybrid_queries.json'))
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--candidates', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=20, help='Timed passes over the query set')
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(args.model)
+
+    with open(args.corpus, encoding='utf-8') as f:
+        chunks = [c['text'] for c in TokenChunker(model.tokenizer).iter_chunks([f.read()])]
+    with open(args.queries, encoding='utf-8') as f:
+        cases = json.load(f)
+
+    vectors = np.asarray(model.encode(chunks, batch_size=64, show_progress_bar=False), dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    index = build_index(vectors)
+
+    start = time.perf_counter()
+    lexical = BM25Index(chunks)
+    bm25_build_ms = (time.perf_counter() - start) * 1000
+
+    # Encoding is shared by both modes, so it is done once and left out of the timings
+    query_embeddings = np.asarray(model.encode([c['query'] for c in cases], show_progress_bar=False), dtype=np.float32)
+    faiss.normalize_L2(query_embeddings)
+    candidates = min(args.candidates, len(chunks))
+    print(f"Corpus: {len(chunks)} chunks, {len(cases)} queries, k={args.k}, BM25 build {bm25_build_ms:.1f} ms")
+
+    modes = {
+        'dense': lambda case, emb: dense_rank(index, emb, args.k),
+        'hybrid': lambda case, emb: hybrid_rank(index, lexical, case['query'], emb, candidates, len(chunks)),
+    }
+    print(f"\n{'mode':<8} {'hit@' + str(args.k):>7} {'ms/query':>9}")
+    for mode, rank in modes.items():
+        hits = 0
+        misses = []
+        for case, emb in zip(cases, query_embeddings):
+            top = rank(case, emb.reshape(1, -1))[:args.k]
+            if any(case['expect'].lower() in chunks[i].lower() for i in top):
+                hits += 1
+            else:
+                misses.append(case['query'])
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for case, emb in zip(cases, query_embeddings):
+                rank(case, emb.reshape(1, -1))
+        per_query_ms = (time.perf_counter() - start) * 1000 / (args.repeat * len(cases))
+
+        print(f"{mode:<8} {hits / len(cases):>7.2f} {per_query_ms:>9.3f}")
+        for query in misses:
+            print(f"         miss: {query}")
+
+
+if __name__ == '__main__':
+    main()
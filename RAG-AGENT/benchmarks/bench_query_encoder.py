@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Queries/sec of query encoding under concurrent load: one forward pass per query vs
+the micro-batching QueryEncoder, with the LRU cache disabled so every query hits the model.
+
+    python benchmarks/bench_query_encoder.py --threads 16 --queries 800 --window-ms 5
+
+Pin the process to one core (taskset -c 0 ...) to measure per-core throughput.
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import faiss
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from query_encoder import QueryEncoder  # noqa: E402
+
+TEMPLATES = [
+    "what are the key points about {}",
+    "summarize the section on {}",
+    "how does {} affect compliance",
+    "explain {} in simple terms",
+]
+TOPICS = ["GDPR fines", "DPDP consent", "V-KYC liveness", "UPI interoperability", "CBDC pilots",
+          "quantum computing", "6G research", "ESG investing", "data localization", "AES-256"]
+
+
+def make_queries(n):
+    # Unique strings, so the measurement is of the model rather than the cache
+    return [TEMPLATES[i % len(TEMPLATES)].format(TOPICS[i % len(TOPICS)]) + f" #{i}" for i in range(n)]
+
+
+def run(encode, queries, threads):
+    latencies = []
+    lock = threading.Lock()
+
+    def one(query):
+        start = time.perf_counter()
+        encode(query)
+        with lock:
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one, queries))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return len(queries) / elapsed, latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.95)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='all-MiniLM-L6-v2')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--queries', type=int, default=800)
+    parser.add_argument('--window-ms', type=float, default=5.0)
+    parser.add_argument('--max-batch', type=int, default=32)
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(args.model)
+    model.encode(["warm up"], show_progress_bar=False)
+
+    def encode_single(query):
+        vector = np.asarray(model.encode([query], show_progress_bar=False), dtype=np.float32)
+        faiss.normalize_L2(vector)
+        return vector
+
+    batched = QueryEncoder(model, cache_size=0, batch_window_ms=args.window_ms, max_batch=args.max_batch)
+    queries = make_queries(args.queries)
+
+    print(f"{args.queries} unique queries from {args.threads} threads\n")
+    print(f"{'mode':<12} {'qps':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for mode, encode in [('single', encode_single), ('micro-batch', batched.encode)]:
+        qps, p50, p95 = run(encode, queries, args.threads)
+        print(f"{mode:<12} {qps:>8.1f} {p50:>8.2f} {p95:>8.2f}")
+    print(f"\nAverage micro-batch size: {batched.stats()['avg_batch_size']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Import-time profile of main.py: how long until the app object exists (and Flask could
+bind its port), how long until the embedding model is ready, and which imports cost most.
+
+    python benchmarks/profile_startup.py --top 20
+    RAG_LOAD_IN_BACKGROUND=false python benchmarks/profile_startup.py   # the old, blocking startup
+
+Runs `python -X importtime` in a fresh interpreter, so nothing is cached in-process.
+"""
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+_APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_CHILD = """
+import time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.rag_ready.wait()
+ready = time.perf_counter()
+print(f"@@startup {imported - started:.3f} {ready - started:.3f} {main.rag_status()['state']}")
+"""
+
+# import time: self [us] | cumulative | imported package
+_IMPORTTIME_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--top', type=int, default=15, help='Show this many most expensive top-level imports')
+    args = parser.parse_args()
+
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', _CHILD],
+                          cwd=_APP_DIR, capture_output=True, text=True)
+    startup = re.search(r"@@startup (\S+) (\S+) (\S+)", proc.stdout)
+    if not startup:
+        sys.stderr.write(proc.stdout[-2000:] + proc.stderr[-2000:])
+        sys.exit("main.py failed to import")
+
+    top_level = []
+    for line in proc.stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        # Top-level imports are indented by a single space
+        if match and len(match.group(3)) == 1:
+            top_level.append((int(match.group(2)), match.group(4)))
+    top_level.sort(reverse=True)
+
+    import_s, ready_s, state = startup.groups()
+    print(f"import main (app object created): {float(import_s):.2f} s")
+    print(f"embedding model ready:            {float(ready_s):.2f} s  (rag state: {state})")
+    print(f"\n{'cumulative ms':>14}  module")
+    for cumulative_us, module in top_level[:args.top]:
+        print(f"{cumulative_us / 1000:>14.1f}  {module}")
+
+
+if __name__ == '__main__':
+    main()
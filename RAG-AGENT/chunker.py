@@ -0,0 +1,145 @@
+"""
+Token-aware streaming chunker for document RAG.
+Text arrives as a stream of pieces (PDF pages, text blocks) and leaves as a stream
+of chunks that fit the embedding model's token budget, with configurable overlap
+and character offsets into the original document. Nothing here ever holds more
+than one paragraph plus one chunk window in memory.
+"""
+import os
+import re
+
+CHUNK_TOKENS = int(os.getenv('CHUNK_TOKENS', '128'))
+CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', '24'))
+# Text with no blank lines (common in PDF extraction) is force-split at a line break past this size
+MAX_PARAGRAPH_CHARS = 16 * 1024
+
+# Fallback when no tokenizer is available: words and punctuation, roughly WordPiece-sized
+_APPROX_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+# A sentence runs from a non-space up to terminal punctuation followed by whitespace, or to the end
+_SENTENCE_RE = re.compile(r"\S.*?(?:[.!?](?=\s)|$)", re.S)
+
+
+def _approx_token_spans(text):
+    return [m.span() for m in _APPROX_TOKEN_RE.finditer(text)]
+
+
+def iter_paragraphs(pieces):
+    """Re-split a stream of text pieces on blank lines; yields (start_offset, paragraph)"""
+    pending = ""
+    pending_start = 0
+    for piece in pieces:
+        pending += piece
+        parts = pending.split('\n\n')
+        pending = parts.pop()
+        for part in parts:
+            yield pending_start, part
+            pending_start += len(part) + 2
+        while len(pending) > MAX_PARAGRAPH_CHARS:
+            cut = pending.rfind('\n', 0, MAX_PARAGRAPH_CHARS)
+            if cut <= 0:
+                cut = pending.rfind(' ', 0, MAX_PARAGRAPH_CHARS)
+            if cut <= 0:
+                cut = MAX_PARAGRAPH_CHARS
+            yield pending_start, pending[:cut]
+            pending = pending[cut:]
+            pending_start += cut
+    if pending:
+        yield pending_start, pending
+
+
+def iter_batches(items, batch_size):
+    """Group any iterable into lists of at most batch_size items"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class TokenChunker:
+    """
+    Packs sentences into chunks of at most chunk_tokens tokens, as counted by the
+    embedding model's own tokenizer (or a word/punctuation approximation without one).
+    Consecutive chunks share up to overlap_tokens tokens of trailing sentences. No text is
+    dropped: a short chunk (such as a document's last few words) is still emitted, since it
+    only exists because it didn't fit in the chunk before it.
+    """
+
+    def __init__(self, tokenizer=None, chunk_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+        if overlap_tokens >= chunk_tokens:
+            raise ValueError("overlap_tokens must be smaller than chunk_tokens")
+        self.tokenizer = tokenizer
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+
+    def token_spans(self, text):
+        """Character (start, end) span of every token in text"""
+        if self.tokenizer is None:
+            return _approx_token_spans(text)
+        try:
+            encoded = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+            return encoded['offset_mapping']
+        except Exception:
+            # Slow (non-Rust) tokenizers have no offset mapping
+            return _approx_token_spans(text)
+
+    def _iter_units(self, pieces):
+        """Sentences as (start, end, text, n_tokens, sep), oversize sentences cut at token boundaries"""
+        for para_start, paragraph in iter_paragraphs(pieces):
+            sep = "\n\n"
+            for match in _SENTENCE_RE.finditer(paragraph):
+                sentence = match.group().strip()
+                if not sentence:
+                    continue
+                start = para_start + match.start()
+                spans = self.token_spans(sentence)
+                if len(spans) <= self.chunk_tokens:
+                    yield start, start + len(sentence), sentence, len(spans), sep
+                else:
+                    for i in range(0, len(spans), self.chunk_tokens):
+                        window = spans[i:i + self.chunk_tokens]
+                        lo, hi = window[0][0], window[-1][1]
+                        yield start + lo, start + hi, sentence[lo:hi], len(window), sep
+                        sep = " "
+                sep = " "
+
+    def _make_chunk(self, window):
+        parts = [window[0][2]]
+        for _, _, unit_text, _, sep in window[1:]:
+            parts.append(sep)
+            parts.append(unit_text)
+        return {'text': "".join(parts), 'start': window[0][0], 'end': window[-1][1],
+                'tokens': sum(unit[3] for unit in window)}
+
+    def iter_chunks(self, pieces):
+        """Yield chunk dicts {'text', 'start', 'end', 'tokens'} from a string or an iterable of text pieces"""
+        if isinstance(pieces, str):
+            pieces = [pieces]
+
+        window = []
+        window_tokens = 0
+        fresh = 0  # Units in the window not already emitted as part of the previous chunk
+        for unit in self._iter_units(pieces):
+            n_tokens = unit[3]
+            if window and window_tokens + n_tokens > self.chunk_tokens:
+                if fresh:
+                    yield self._make_chunk(window)
+                # Carry trailing units forward as overlap
+                carried = []
+                carried_tokens = 0
+                for prev in reversed(window):
+                    if carried_tokens + prev[3] > self.overlap_tokens or carried_tokens + prev[3] + n_tokens > self.chunk_tokens:
+                        break
+                    carried.insert(0, prev)
+                    carried_tokens += prev[3]
+                window, window_tokens, fresh = carried, carried_tokens, 0
+
+            window.append(unit)
+            window_tokens += n_tokens
+            fresh += 1
+
+        if window and fresh:
+            yield self._make_chunk(window)
@@ -0,0 +1,212 @@
+"""
+Streaming text extraction for uploaded documents.
+iter_document_text yields text lazily (one PDF page, DOCX paragraph or text block
+at a time) from a file-like object, so callers never hold the whole document as
+one string and the upload never has to round-trip through UPLOAD_FOLDER.
+Large PDFs are split into page ranges and extracted on a process pool, since
+PyPDF2's extract_text is pure Python and CPU-bound.
+"""
+import io
+import os
+import sys
+import codecs
+import shutil
+import tempfile
+import threading
+import multiprocessing
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+# Uploads smaller than this stay in memory, larger ones spill to a temp file
+UPLOAD_SPOOL_MAX_MEMORY = 2 * 1024 * 1024
+TEXT_BLOCK_SIZE = 64 * 1024
+
+PDF_EXTRACT_WORKERS = int(os.getenv('PDF_EXTRACT_WORKERS', str(min(4, os.cpu_count() or 1))))
+# Below this many pages the pool overhead outweighs the gain, extract serially
+PDF_PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', '24'))
+# fork would copy a process that has torch, grpc and gunicorn threads running (and whatever
+# locks they hold), so workers come from a clean forkserver where available, spawn elsewhere.
+PDF_EXTRACT_START_METHOD = os.getenv(
+    'PDF_EXTRACT_START_METHOD',
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+)
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+_main_script_lock = threading.Lock()
+# In a pool worker: (path, PdfReader) of the PDF it is extracting, so the document is read
+# and parsed once per worker instead of once per page range
+_worker_pdf = None
+
+
+def spool_upload(file_storage):
+    """Copy a werkzeug upload into a SpooledTemporaryFile that outlives the request"""
+    spooled = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_MEMORY)
+    file_storage.save(spooled)
+    spooled.seek(0)
+    return spooled
+
+
+@contextmanager
+def _main_script_hidden():
+    """
+    spawn and forkserver children re-run the parent's __main__ script (main.py under
+    `python main.py`: Supabase client, message journal, Gemini pool...) before their first
+    task. Workers only need this module, so the script path is withheld while they start.
+    """
+    with _main_script_lock:
+        main_module = sys.modules['__main__']
+        main_path = getattr(main_module, '__file__', None)
+        if main_path is None or getattr(main_module.__spec__, 'name', None):
+            yield
+            return
+        del main_module.__file__
+        try:
+            yield
+        finally:
+            main_module.__file__ = main_path
+
+
+class _PdfWorkerProcess(multiprocessing.process.BaseProcess):
+    """Pool worker process started the PDF_EXTRACT_START_METHOD way, without the parent's __main__"""
+    _start_method = PDF_EXTRACT_START_METHOD
+
+    @staticmethod
+    def _Popen(process_obj):
+        with _main_script_hidden():
+            return multiprocessing.get_context(PDF_EXTRACT_START_METHOD).Process._Popen(process_obj)
+
+
+def _pdf_context():
+    context = type(multiprocessing.get_context(PDF_EXTRACT_START_METHOD))()
+    context.Process = _PdfWorkerProcess
+    return context
+
+
+def _get_pdf_pool():
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS, mp_context=_pdf_context())
+        return _pdf_pool
+
+
+def _page_range_text(reader, start, stop):
+    return [(reader.pages[i].extract_text() or "") + "\n" for i in range(start, stop)]
+
+
+def _extract_page_range(pdf_path, start, stop):
+    """Process-pool task: text of pages [start, stop) of the PDF at pdf_path"""
+    global _worker_pdf
+    import PyPDF2
+
+    if _worker_pdf is None or _worker_pdf[0] != pdf_path:
+        with open(pdf_path, 'rb') as f:
+            _worker_pdf = (pdf_path, PyPDF2.PdfReader(io.BytesIO(f.read())))
+    return _page_range_text(_worker_pdf[1], start, stop)
+
+
+def _iter_pdf_pages_parallel(stream, reader, pages_total, progress, workers):
+    # Tasks get a path, not the document: nothing big goes through the pool's queue
+    stream.seek(0)
+    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as pdf_file:
+        shutil.copyfileobj(stream, pdf_file)
+    pdf_path = pdf_file.name
+
+    # Several ranges per worker so one slow range doesn't leave the others idle
+    range_size = max(4, -(-pages_total // (workers * 4)))
+    ranges = [(start, min(start + range_size, pages_total)) for start in range(0, pages_total, range_size)]
+    print(f"⚙️ Extracting {pages_total} PDF pages on {workers} processes ({len(ranges)} ranges)")
+
+    # At most 2 ranges per worker in flight: extracted text waits in finished futures until the
+    # chunker gets to it, so submitting every range up front would hold the whole PDF's text
+    in_flight = deque()
+    unsubmitted = iter(ranges)
+    try:
+        pool = _get_pdf_pool()
+
+        def submit_next():
+            page_range = next(unsubmitted, None)
+            if page_range:
+                in_flight.append((page_range, pool.submit(_extract_page_range, pdf_path, *page_range)))
+
+        for _ in range(2 * workers):
+            submit_next()
+        while in_flight:
+            (start, stop), future = in_flight.popleft()
+            try:
+                pages = future.result()
+            except Exception as e:
+                print(f"⚠️ Parallel extraction of pages {start}-{stop} failed ({e}), extracting serially")
+                pages = _page_range_text(reader, start, stop)
+            submit_next()
+            # Results are merged strictly in page order
+            yield from pages
+            if progress:
+                progress(stop, pages_total)
+    finally:
+        # The consumer may stop early (a failed or abandoned ingest); don't leave the pool busy with unread ranges
+        for _, future in in_flight:
+            future.cancel()
+        try:
+            os.remove(pdf_path)
+        except OSError:
+            pass  # Windows: a worker may still have it open; it stays in the temp dir
+
+
+def iter_pdf_pages(stream, progress=None, workers=None):
+    """Yield the text of each PDF page in order; progress(pages_processed, pages_total) as pages complete"""
+    import PyPDF2
+
+    workers = PDF_EXTRACT_WORKERS if workers is None else workers
+    reader = PyPDF2.PdfReader(stream)
+    pages_total = len(reader.pages)
+
+    if workers > 1 and pages_total >= PDF_PARALLEL_MIN_PAGES:
+        yield from _iter_pdf_pages_parallel(stream, reader, pages_total, progress, workers)
+        return
+
+    for page_number, page in enumerate(reader.pages, start=1):
+        yield (page.extract_text() or "") + "\n"
+        if progress:
+            progress(page_number, pages_total)
+
+
+def iter_docx_paragraphs(stream):
+    from docx import Document
+
+    for paragraph in Document(stream).paragraphs:
+        yield paragraph.text + "\n"
+
+
+def iter_text_blocks(stream, block_size=TEXT_BLOCK_SIZE):
+    # Incremental decoder so multi-byte characters split across blocks survive
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        yield decoder.decode(block)
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def iter_document_text(stream, filename, progress=None):
+    """Yield the text of an uploaded document piece by piece, picking the reader by file extension"""
+    filename_lower = filename.lower()
+    if filename_lower.endswith('.pdf'):
+        return iter_pdf_pages(stream, progress)
+    if filename_lower.endswith('.docx'):
+        return iter_docx_paragraphs(stream)
+    return iter_text_blocks(stream)
+
+
+def extract_text(file_content, filename):
+    """Whole-document convenience wrapper around iter_document_text for bytes or str content"""
+    if isinstance(file_content, str):
+        if filename.lower().endswith(('.txt', '.md')):
+            return file_content
+        file_content = file_content.encode('utf-8')
+    return "".join(iter_document_text(io.BytesIO(file_content), filename))
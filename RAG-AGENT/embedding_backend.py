@@ -0,0 +1,184 @@
+"""
+Pluggable embedding backends for the document RAG model.
+
+EMBEDDING_BACKEND=torch (default) loads SentenceTransformer as before.
+EMBEDDING_BACKEND=onnx runs an int8-quantized ONNX export of the same model on
+ONNX Runtime, without importing torch. Build the export once with:
+
+    python embedding_backend.py export
+
+The export is checked against the torch model before it is written, so its vectors
+stay interchangeable with existing indexes and the embedding cache. If the ONNX
+backend can't be loaded the service falls back to torch.
+"""
+import os
+import json
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'torch').lower()
+ONNX_MODEL_DIR = os.getenv('ONNX_MODEL_DIR', os.path.join(_HERE, 'onnx_models'))
+ONNX_THREADS = int(os.getenv('ONNX_THREADS', '0'))  # 0 lets ONNX Runtime decide
+# Minimum cosine similarity between torch and ONNX vectors for an export to be accepted
+ONNX_MIN_COSINE = float(os.getenv('ONNX_MIN_COSINE', '0.98'))
+
+QUANTIZED_FILE = 'model.int8.onnx'
+CONFIG_FILE = 'embedding_config.json'
+
+_CHECK_SENTENCES = [
+    "GDPR fines reach 4% of annual global turnover.",
+    "India's DPDP Act 2023 allows penalties up to 500 crore rupees.",
+    "Video KYC requires real-time liveness detection.",
+    "Quantum computing could break current public-key cryptography.",
+    "summarize",
+    "What are the key points of this document?",
+]
+
+
+def _model_dir(model_name, root=ONNX_MODEL_DIR):
+    return os.path.join(root, model_name.replace('/', '_'))
+
+
+class OnnxEmbeddingModel:
+    """
+    Drop-in for the parts of SentenceTransformer the service uses: encode() and .tokenizer.
+    Mean pooling and L2 normalization match all-MiniLM-L6-v2's sentence-transformers pipeline.
+    """
+
+    def __init__(self, model_dir, threads=ONNX_THREADS):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(model_dir, CONFIG_FILE)) as f:
+            self.config = json.load(f)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_seq_length = self.config['max_seq_length']
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, QUANTIZED_FILE), options, providers=['CPUExecutionProvider']
+        )
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+    def get_sentence_embedding_dimension(self):
+        return self.config['dimension']
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, convert_to_numpy=True, **kwargs):
+        import numpy as np
+
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        if not sentences:
+            return np.zeros((0, self.config['dimension']), dtype=np.float32)
+
+        # Sorting by length keeps padding per batch small, as SentenceTransformer does
+        order = sorted(range(len(sentences)), key=lambda i: -len(sentences[i]))
+        out = np.empty((len(sentences), self.config['dimension']), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            batch_ids = order[start:start + batch_size]
+            encoded = self.tokenizer(
+                [sentences[i] for i in batch_ids], padding=True, truncation=True,
+                max_length=self.max_seq_length, return_tensors='np'
+            )
+            feeds = {name: encoded[name].astype(np.int64) for name in self._input_names if name in encoded}
+            token_embeddings = self.session.run(None, feeds)[0]
+
+            mask = encoded['attention_mask'][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if self.config.get('normalize', True):
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            out[batch_ids] = pooled
+
+        return out[0] if single else out
+
+
+def load_embedding_model(model_name, backend=EMBEDDING_BACKEND):
+    """Load the configured backend, falling back to SentenceTransformer (torch) if ONNX is unavailable"""
+    if backend == 'onnx':
+        try:
+            model = OnnxEmbeddingModel(_model_dir(model_name))
+            print(f"⚡ Loaded int8 ONNX Runtime embedding backend for {model_name}")
+            return model
+        except Exception as e:
+            print(f"⚠️ ONNX embedding backend unavailable ({e}); falling back to torch. "
+                  f"Build it with: python embedding_backend.py export")
+
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
+
+
+def export_onnx(model_name, root=ONNX_MODEL_DIR, min_cosine=ONNX_MIN_COSINE):
+    """Export model_name to ONNX, quantize it to int8 and check it against the torch model"""
+    import numpy as np
+    import torch
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    from sentence_transformers import SentenceTransformer
+
+    model_dir = _model_dir(model_name, root)
+    os.makedirs(model_dir, exist_ok=True)
+    reference = SentenceTransformer(model_name, device='cpu')
+    transformer = reference[0].auto_model.eval()
+    tokenizer = reference.tokenizer
+    normalize = any(type(module).__name__ == 'Normalize' for module in reference)
+
+    sample = tokenizer(["export sample"], return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+    fp32_path = os.path.join(model_dir, 'model.onnx')
+    print(f"📦 Exporting {model_name} to ONNX...")
+
+    class _LastHiddenState(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs))).last_hidden_state
+
+    with torch.no_grad():
+        torch.onnx.export(
+            _LastHiddenState(transformer), tuple(sample[name] for name in input_names), fp32_path,
+            input_names=input_names, output_names=['last_hidden_state'],
+            dynamic_axes={**{name: {0: 'batch', 1: 'sequence'} for name in input_names},
+                          'last_hidden_state': {0: 'batch', 1: 'sequence'}},
+            opset_version=14
+        )
+
+    print("🔧 Quantizing to int8...")
+    quantize_dynamic(fp32_path, os.path.join(model_dir, QUANTIZED_FILE), weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+
+    tokenizer.save_pretrained(model_dir)
+    with open(os.path.join(model_dir, CONFIG_FILE), 'w') as f:
+        json.dump({
+            'model': model_name,
+            'dimension': reference.get_sentence_embedding_dimension(),
+            'max_seq_length': reference.max_seq_length,
+            'normalize': normalize
+        }, f, indent=2)
+
+    expected = reference.encode(_CHECK_SENTENCES, convert_to_numpy=True, normalize_embeddings=True)
+    actual = OnnxEmbeddingModel(model_dir).encode(_CHECK_SENTENCES)
+    actual = actual / np.linalg.norm(actual, axis=1, keepdims=True)
+    worst = float((expected * actual).sum(axis=1).min())
+    print(f"🔍 Worst cosine similarity to the torch model: {worst:.4f}")
+    if worst < min_cosine:
+        os.remove(os.path.join(model_dir, CONFIG_FILE))
+        raise RuntimeError(f"Quantized export drifted too far from {model_name} (cosine {worst:.4f} < {min_cosine})")
+
+    print(f"✅ ONNX embedding backend written to {model_dir}")
+    return model_dir
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the int8 ONNX Runtime embedding backend")
+    parser.add_argument('command', choices=['export'])
+    parser.add_argument('--model', default='all-MiniLM-L6-v2')
+    parser.add_argument('--out', default=ONNX_MODEL_DIR)
+    args = parser.parse_args()
+
+    export_onnx(args.model, args.out)
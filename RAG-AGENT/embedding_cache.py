@@ -0,0 +1,131 @@
+"""
+Persistent content-hash embedding cache shared across conversations.
+Chunks are keyed by (model name, sha256 of whitespace-normalized text) in SQLite,
+so re-uploading known content skips the SentenceTransformer forward pass.
+"""
+import os
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from rag_store import LOCAL_STATE_DIR
+
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', os.path.join(LOCAL_STATE_DIR, 'embedding_cache.sqlite3'))
+
+# SQLite's default limit on bound parameters is 999
+_LOOKUP_BATCH = 500
+
+
+def chunk_hash(text):
+    normalized = " ".join(text.split())
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, model_name, path=EMBEDDING_CACHE_PATH):
+        self.model_name = model_name
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn_pid = None
+        self._conn = self._connect()
+
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " hash TEXT NOT NULL,"
+            " dim INTEGER NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, hash))"
+        )
+        conn.commit()
+        self._conn_pid = os.getpid()
+        return conn
+
+    @property
+    def conn(self):
+        """This process's connection; a SQLite connection must not be used across fork()"""
+        if self._conn_pid != os.getpid():
+            self._conn = self._connect()
+        return self._conn
+
+    def _lookup(self, hashes):
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            for start in range(0, len(unique), _LOOKUP_BATCH):
+                batch = unique[start:start + _LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT hash, dim, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                    [self.model_name] + batch
+                ).fetchall()
+                for h, dim, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32, count=dim)
+        return found
+
+    def _store(self, hashes, vectors):
+        rows = [(self.model_name, h, int(v.shape[0]), np.ascontiguousarray(v, dtype=np.float32).tobytes())
+                for h, v in zip(hashes, vectors)]
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, hash, dim, vector) VALUES (?, ?, ?, ?)", rows
+            )
+            self.conn.commit()
+
+    def encode(self, model, texts, out=None, batch_size=32):
+        """
+        Drop-in for model.encode(texts) that only runs the model on chunks it has never seen.
+        Vectors are written straight into out (a preallocated (len(texts), dim) float32 array) when given.
+        """
+        hashes = [chunk_hash(t) for t in texts]
+        cached = self._lookup(hashes)
+
+        missing = {}
+        for text, h in zip(texts, hashes):
+            if h not in cached and h not in missing:
+                missing[h] = text
+
+        miss_count = sum(1 for h in hashes if h not in cached)
+        with self._lock:
+            self.hits += len(texts) - miss_count
+            self.misses += miss_count
+
+        if missing:
+            print(f"🧮 Embedding cache: encoding {len(missing)} new chunks, {len(texts) - len(missing)} cached")
+            new_vectors = np.asarray(
+                model.encode(list(missing.values()), batch_size=batch_size, show_progress_bar=False),
+                dtype=np.float32
+            )
+            self._store(list(missing.keys()), new_vectors)
+            cached.update(zip(missing.keys(), new_vectors))
+        else:
+            print(f"⚡ Embedding cache: all {len(texts)} chunks cached, skipping model")
+
+        if out is None:
+            dim = cached[hashes[0]].shape[0]
+            out = np.empty((len(texts), dim), dtype=np.float32)
+        for row, h in enumerate(hashes):
+            out[row] = cached[h]
+        return out
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            entries = self.conn.execute(
+                "SELECT COUNT(*) FROM embeddings WHERE model = ?", (self.model_name,)
+            ).fetchone()[0]
+            return {
+                'model': self.model_name,
+                'entries': entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+            }
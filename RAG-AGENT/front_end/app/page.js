@@ -298,12 +298,26 @@ else if (msg.role === 'assistant') {
       formData.append('user_email', userEmail);
       formData.append('conversation_id', currentConversation);
 
-      const response = await axios.post(`${API_BASE}/upload`, formData, {
+      let response = await axios.post(`${API_BASE}/upload`, formData, {
         headers: {
           'Content-Type': 'multipart/form-data',
         },
       });
 
+      // Extraction and embedding run in the background; poll the job until it settles
+      while (response.data.status === 'processing' && response.data.job_id) {
+        const { stage, pages_processed, pages_total, chunks_embedded, chunks_total } = response.data;
+        if (stage === 'extracting' && pages_total) {
+          setUploadStatus(`📄 Reading document... page ${pages_processed}/${pages_total}`);
+        } else if (stage === 'embedding') {
+          setUploadStatus(`🧠 Analyzing document... ${chunks_embedded}${chunks_total ? `/${chunks_total}` : ''} chunks`);
+        } else {
+          setUploadStatus('⚙️ Processing document...');
+        }
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        response = await axios.get(`${API_BASE}/upload/${response.data.job_id}`);
+      }
+
       if (response.data.status === 'success') {
         setDocJustUploaded(true);
         setHasDocumentUploaded(true); 
@@ -0,0 +1,52 @@
+"""
+Process-wide Gemini client.
+genai.configure() throws away the SDK's cached API clients (and their open connections), so
+calling it per request paid for a fresh channel and model object every time. Here it runs
+once per process, lazily, and GenerativeModel instances are reused per model name.
+"""
+import os
+import threading
+
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-1.5-pro')
+# grpc keeps one long-lived HTTP/2 channel; 'rest' uses a keep-alive requests session instead
+GEMINI_TRANSPORT = os.getenv('GEMINI_TRANSPORT', 'grpc')
+
+
+class GeminiClientPool:
+    def __init__(self, transport=GEMINI_TRANSPORT):
+        self.transport = transport
+        self._lock = threading.Lock()
+        self._models = {}
+        self._configured_pid = None
+        self._configured_key = None
+
+    def _genai(self):
+        import google.generativeai as genai
+
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise RuntimeError("GEMINI_API_KEY not found in environment variables.")
+        # Channels don't survive fork, so each worker process configures its own
+        if self._configured_pid != os.getpid() or self._configured_key != api_key:
+            genai.configure(api_key=api_key, transport=self.transport)
+            self._models = {}
+            self._configured_pid = os.getpid()
+            self._configured_key = api_key
+        return genai
+
+    def model(self, name=GEMINI_MODEL):
+        with self._lock:
+            genai = self._genai()
+            model = self._models.get(name)
+            if model is None:
+                model = genai.GenerativeModel(name)
+                self._models[name] = model
+            return model
+
+    def generate(self, prompt, max_tokens=None, model_name=GEMINI_MODEL, stream=False):
+        """generate_content with max_tokens applied as generation_config.max_output_tokens"""
+        generation_config = {'max_output_tokens': int(max_tokens)} if max_tokens else None
+        return self.model(model_name).generate_content(prompt, generation_config=generation_config, stream=stream)
+
+
+gemini_pool = GeminiClientPool()
@@ -0,0 +1,38 @@
+"""
+Production server config:
+
+    gunicorn -c gunicorn.conf.py main:app
+
+The app (and the embedding model with it) is loaded once in the master before the
+workers are forked, so the model weights are shared copy-on-write instead of loaded per
+worker. Conversation RAG state lives in RAG_INDEX_DIR, which every worker reads and
+writes, so any worker can answer any conversation.
+"""
+import gc
+import os
+import multiprocessing
+
+# The model must be fully loaded before fork; a background loader thread would not survive it
+os.environ.setdefault('RAG_LOAD_IN_BACKGROUND', 'false')
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv('WEB_CONCURRENCY', str(min(4, multiprocessing.cpu_count()))))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+preload_app = True
+# Summaries and uploads can hold a request for a while (Gemini, web search, spooling)
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then to bound slow leaks (native libs, fragmentation)
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = 200
+accesslog = '-'
+errorlog = '-'
+
+
+def when_ready(server):
+    # Move everything allocated so far (model, imports) out of the GC's reach, so collections
+    # in the workers don't touch those pages and break copy-on-write sharing
+    gc.freeze()
+    server.log.info("Preloaded app; forking %s workers x %s threads", workers, threads)
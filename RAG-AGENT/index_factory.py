@@ -0,0 +1,127 @@
+"""
+FAISS index tiers for document RAG.
+Small conversations keep an exact IndexFlatIP; past ANN_HNSW_MIN_VECTORS chunks the
+index is rebuilt as HNSW, and past ANN_IVFPQ_MIN_VECTORS as a trained IVF-PQ index with
+an exact refine stage (RFlat): PQ picks k * k_factor candidates, which are re-ranked on the
+original float vectors. PQ alone loses too much to quantization to rank chunks usefully.
+nprobe / efSearch are per-search knobs passed as SearchParameters, so concurrent
+requests never change each other's settings on a shared index.
+"""
+import os
+import math
+import numpy as np
+import faiss
+from rag_store import index_vectors
+
+ANN_HNSW_MIN_VECTORS = int(os.getenv('ANN_HNSW_MIN_VECTORS', '20000'))
+ANN_IVFPQ_MIN_VECTORS = int(os.getenv('ANN_IVFPQ_MIN_VECTORS', '500000'))
+HNSW_M = int(os.getenv('ANN_HNSW_M', '32'))
+HNSW_EF_CONSTRUCTION = int(os.getenv('ANN_HNSW_EF_CONSTRUCTION', '80'))
+DEFAULT_EF_SEARCH = int(os.getenv('ANN_EF_SEARCH', '64'))
+DEFAULT_NPROBE = int(os.getenv('ANN_NPROBE', '16'))
+# IVF-PQ candidates re-ranked exactly per result
+DEFAULT_K_FACTOR = int(os.getenv('ANN_REFINE_K_FACTOR', '64'))
+# FAISS wants roughly 39+ training points per centroid; cap training cost on huge corpora
+IVF_TRAIN_POINTS_PER_LIST = 64
+
+TIER_FLAT = 'flat'
+TIER_HNSW = 'hnsw'
+TIER_IVFPQ = 'ivfpq'
+
+
+def choose_tier(n_vectors):
+    if n_vectors >= ANN_IVFPQ_MIN_VECTORS:
+        return TIER_IVFPQ
+    if n_vectors >= ANN_HNSW_MIN_VECTORS:
+        return TIER_HNSW
+    return TIER_FLAT
+
+
+def index_tier(index):
+    if faiss.try_extract_index_ivf(index) is not None:
+        return TIER_IVFPQ
+    if isinstance(index, faiss.IndexHNSW):
+        return TIER_HNSW
+    return TIER_FLAT
+
+
+def _pq_subquantizers(dim):
+    # About 8 dimensions per sub-quantizer; m must divide dim
+    for m in range(max(1, dim // 8), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def build_index(vectors, tier=None):
+    """Build (and train if needed) an inner-product index over normalized float32 vectors"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+    tier = tier or choose_tier(n)
+
+    if tier == TIER_HNSW:
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    elif tier == TIER_IVFPQ:
+        nlist = max(1, int(4 * math.sqrt(n)))
+        index = faiss.index_factory(dim, f"IVF{nlist},PQ{_pq_subquantizers(dim)},RFlat", faiss.METRIC_INNER_PRODUCT)
+        train_size = min(n, nlist * IVF_TRAIN_POINTS_PER_LIST)
+        sample = vectors if train_size == n else vectors[np.random.default_rng(0).choice(n, train_size, replace=False)]
+        print(f"🏋️ Training IVF-PQ index: {nlist} lists on {train_size} vectors")
+        index.train(sample)
+    else:
+        index = faiss.IndexFlatIP(dim)
+
+    if n:
+        index.add(vectors)
+    return index
+
+
+def maybe_upgrade_index(index):
+    """Rebuild a flat index as HNSW / IVF-PQ once it has grown past the tier threshold"""
+    target = choose_tier(index.ntotal)
+    if target == index_tier(index) or target == TIER_FLAT:
+        return index
+    print(f"📈 Upgrading {index_tier(index)} index with {index.ntotal} vectors to {target}")
+    return build_index(index_vectors(index), target)
+
+
+def remove_positions(index, positions):
+    """
+    Remove vectors by position and keep the remaining ones in order, so they stay
+    aligned with the chunk list. Flat indexes compact in place. IVF-PQ keeps its
+    training and is refilled from the exact vectors of its refine stage; HNSW cannot
+    remove, so it is rebuilt from its exact (HNSWFlat) storage. Both are slow on big
+    indexes, so callers run them off the request thread.
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    tier = index_tier(index)
+    if tier == TIER_FLAT:
+        index.remove_ids(positions)
+        return index
+    keep = np.ones(index.ntotal, dtype=bool)
+    keep[positions] = False
+    vectors = index_vectors(index)[keep]
+    if tier == TIER_IVFPQ and isinstance(index, faiss.IndexRefine):
+        index.reset()
+        if len(vectors):
+            index.add(vectors)
+        return index
+    # HNSW, or an IVF-PQ index saved before the refine stage (reconstructed lossily, once)
+    return build_index(vectors)
+
+
+def search_index(index, queries, k, nprobe=None, ef_search=None, k_factor=None):
+    """index.search with per-call nprobe / efSearch / refine k_factor for the ANN tiers"""
+    tier = index_tier(index)
+    params = None
+    if tier == TIER_HNSW:
+        params = faiss.SearchParametersHNSW(efSearch=int(ef_search or DEFAULT_EF_SEARCH))
+    elif tier == TIER_IVFPQ:
+        params = ivf_params = faiss.SearchParametersIVF(nprobe=int(nprobe or DEFAULT_NPROBE))
+        if isinstance(index, faiss.IndexRefine):
+            params = faiss.IndexRefineSearchParameters(k_factor=k_factor or DEFAULT_K_FACTOR,
+                                                       base_index_params=ivf_params)
+    if params is None:
+        return index.search(queries, k)
+    return index.search(queries, k, params=params)
@@ -0,0 +1,255 @@
+"""
+Background ingestion jobs for document uploads.
+/upload hands the file to a bounded worker pool and returns a job id right away;
+extraction, chunking and embedding run off the request thread and report their
+progress on the job, which GET /upload/<job_id> exposes. Removing a document from a
+large (HNSW / IVF-PQ) index rebuilds it, so that runs on the same pool.
+Job status is also written to INGEST_STATUS_DIR, so under a multi-process server any
+worker can report progress on, or wait for, an upload another worker is running.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from rag_store import RAG_INDEX_DIR, valid_conversation_id
+
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '2'))
+INGEST_MAX_PENDING = int(os.getenv('INGEST_MAX_PENDING', '16'))
+INGEST_JOB_RETENTION_SECONDS = int(os.getenv('INGEST_JOB_RETENTION_SECONDS', '3600'))
+INGEST_STATUS_DIR = os.getenv('INGEST_STATUS_DIR', os.path.join(RAG_INDEX_DIR, 'jobs'))
+# A job whose status hasn't been refreshed for this long belongs to a worker that died
+INGEST_STALE_SECONDS = int(os.getenv('INGEST_STALE_SECONDS', '600'))
+# Progress snapshots are written at most this often; stage changes are always written
+_STATUS_WRITE_INTERVAL = 0.5
+_JOB_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+STAGE_QUEUED = 'queued'
+STAGE_EXTRACTING = 'extracting'
+STAGE_CHUNKING = 'chunking'
+STAGE_EMBEDDING = 'embedding'
+STAGE_REMOVING = 'removing'
+STAGE_DONE = 'done'
+STAGE_ERROR = 'error'
+
+
+class IngestQueueFull(Exception):
+    pass
+
+
+class IngestJob:
+    def __init__(self, conversation_id, filename, doc_id=None):
+        self.job_id = uuid.uuid4().hex
+        self.doc_id = doc_id or uuid.uuid4().hex
+        self.conversation_id = conversation_id
+        self.filename = filename
+        self.stage = STAGE_QUEUED
+        self.pages_total = None
+        self.pages_processed = 0
+        self.chunks_total = None
+        self.chunks_embedded = 0
+        self.characters = 0
+        self.message = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._done = threading.Event()
+        self._on_change = None
+        self._persisted_at = 0.0
+
+    def update(self, **fields):
+        for key, value in fields.items():
+            setattr(self, key, value)
+        if self._on_change:
+            self._on_change(self, force='stage' in fields)
+
+    @property
+    def finished(self):
+        return self._done.is_set()
+
+    def finish(self, message=None, error=None):
+        self.stage = STAGE_ERROR if error else STAGE_DONE
+        self.message = message
+        self.error = error
+        self.finished_at = time.time()
+        if self._on_change:
+            self._on_change(self, force=True)
+        self._done.set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'doc_id': self.doc_id,
+            'conversation_id': self.conversation_id,
+            'filename': self.filename,
+            'stage': self.stage,
+            'pages_total': self.pages_total,
+            'pages_processed': self.pages_processed,
+            'chunks_total': self.chunks_total,
+            'chunks_embedded': self.chunks_embedded,
+            'characters': self.characters,
+            'message': self.message,
+            'error': self.error,
+            'elapsed_seconds': round((self.finished_at or time.time()) - self.created_at, 2)
+        }
+
+
+class StoredIngestJob:
+    """Read-only view of a job another worker process is running, loaded from its status file"""
+
+    def __init__(self, data):
+        self._data = data
+        self.job_id = data['job_id']
+        self.conversation_id = data.get('conversation_id')
+        self.stage = data.get('stage')
+
+    @property
+    def finished(self):
+        return self.stage in (STAGE_DONE, STAGE_ERROR)
+
+    def to_dict(self):
+        return {k: v for k, v in self._data.items() if k != 'updated_at'}
+
+
+class IngestJobQueue:
+    """Bounded worker pool for ingestion jobs; rejects new work once max_pending jobs are unfinished"""
+
+    def __init__(self, max_workers=INGEST_WORKERS, max_pending=INGEST_MAX_PENDING,
+                 retention_seconds=INGEST_JOB_RETENTION_SECONDS, status_dir=INGEST_STATUS_DIR):
+        self.max_pending = max_pending
+        self.retention_seconds = retention_seconds
+        self.status_dir = status_dir
+        os.makedirs(os.path.join(status_dir, 'pending'), exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ingest')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _status_path(self, job_id):
+        return os.path.join(self.status_dir, job_id + '.json')
+
+    def _pending_dir(self, conversation_id):
+        # Same rule as DiskIndexStore: the id comes from the client and must not name '..' or a dot-file
+        if not valid_conversation_id(conversation_id):
+            raise ValueError(f"Invalid conversation id: {conversation_id!r}")
+        return os.path.join(self.status_dir, 'pending', str(conversation_id))
+
+    def _persist(self, job, force=False):
+        """Write the job's status file (throttled) and keep its pending marker fresh"""
+        now = time.time()
+        if not force and now - job._persisted_at < _STATUS_WRITE_INTERVAL:
+            return
+        job._persisted_at = now
+        try:
+            path = self._status_path(job.job_id)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(dict(job.to_dict(), updated_at=now), f)
+            os.replace(path + '.tmp', path)
+
+            marker = os.path.join(self._pending_dir(job.conversation_id), job.job_id)
+            if job.stage in (STAGE_DONE, STAGE_ERROR):
+                if os.path.exists(marker):
+                    os.remove(marker)
+            else:
+                os.makedirs(os.path.dirname(marker), exist_ok=True)
+                with open(marker, 'a'):
+                    os.utime(marker)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Could not write status for ingest job {job.job_id}: {e}")
+
+    def submit(self, job, target, *args):
+        """Run target(job, *args) on the pool; target reports progress via job.update and must not finish the job"""
+        with self._lock:
+            self._prune()
+            pending = sum(1 for j in self._jobs.values() if not j.finished)
+            if pending >= self.max_pending:
+                raise IngestQueueFull(f"{pending} uploads already in progress, try again shortly")
+            self._jobs[job.job_id] = job
+
+        job._on_change = self._persist
+        self._persist(job, force=True)
+        self._executor.submit(self._run, job, target, args)
+        return job
+
+    def _run(self, job, target, args):
+        try:
+            message = target(job, *args)
+            job.finish(message=message)
+            print(f"✅ Ingest job {job.job_id} finished: {message}")
+        except Exception as e:
+            traceback.print_exc()
+            job.finish(error=str(e))
+            print(f"❌ Ingest job {job.job_id} failed: {e}")
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        expired = [jid for jid, j in self._jobs.items() if j.finished and j.finished_at < cutoff]
+        for jid in expired:
+            del self._jobs[jid]
+
+        try:
+            with os.scandir(self.status_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.json') and entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+        except OSError:
+            pass
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job or not _JOB_ID_RE.match(job_id):
+            return job
+        # Started by another worker process
+        try:
+            with open(self._status_path(job_id)) as f:
+                return StoredIngestJob(json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def _remote_pending(self, conversation_id):
+        """Job ids of this conversation's uploads running in other worker processes"""
+        try:
+            pending_dir = self._pending_dir(conversation_id)
+            names = os.listdir(pending_dir)
+        except (FileNotFoundError, ValueError):
+            return []
+        with self._lock:
+            local = set(self._jobs)
+        stale_before = time.time() - INGEST_STALE_SECONDS
+        pending = []
+        for name in names:
+            if name in local:
+                continue
+            try:
+                if os.path.getmtime(os.path.join(pending_dir, name)) >= stale_before:
+                    pending.append(name)
+            except FileNotFoundError:
+                continue
+        return pending
+
+    def pending_for(self, conversation_id):
+        with self._lock:
+            jobs = [j for j in self._jobs.values() if j.conversation_id == conversation_id and not j.finished]
+        return jobs + [job for job in map(self.get, self._remote_pending(conversation_id)) if job and not job.finished]
+
+    def wait_for_conversation(self, conversation_id, timeout):
+        """Wait up to timeout seconds for a conversation's uploads; returns True once none are pending"""
+        deadline = time.monotonic() + timeout
+        for job in self.pending_for(conversation_id):
+            if isinstance(job, StoredIngestJob):
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not job.wait(remaining):
+                return False
+        # Uploads in other worker processes can only be polled
+        while self._remote_pending(conversation_id):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.1)
+        return True
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Global knowledge index built from comprehensive_news_knowledge.txt.
+
+Build step (run at deploy time, or whenever the knowledge file changes):
+
+    python knowledge_index.py
+
+chunks and embeds the file into a versioned directory under KNOWLEDGE_INDEX_DIR and
+points CURRENT at it. The service mmap-loads the CURRENT version at startup and
+searches it before paying for a web search.
+"""
+import os
+import json
+import time
+import hashlib
+import numpy as np
+import faiss
+from chunker import TokenChunker, iter_batches
+from index_factory import build_index, search_index
+from rag_store import read_index_mmap
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+KNOWLEDGE_SOURCE = os.getenv('KNOWLEDGE_SOURCE', os.path.join(_HERE, 'comprehensive_news_knowledge.txt'))
+KNOWLEDGE_INDEX_DIR = os.getenv('KNOWLEDGE_INDEX_DIR', os.path.join(_HERE, 'knowledge_index'))
+
+CURRENT_FILE = 'CURRENT'
+MANIFEST_FILE = 'manifest.json'
+INDEX_FILE = 'index.faiss'
+CHUNKS_FILE = 'chunks.json'
+
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def build_knowledge_index(model, model_name, source=KNOWLEDGE_SOURCE, out_dir=KNOWLEDGE_INDEX_DIR, batch_size=64):
+    """Chunk, embed and write a new index version; returns the version name"""
+    chunker = TokenChunker(getattr(model, 'tokenizer', None))
+    source_sha = _sha256_file(source)
+    version = f"{source_sha[:12]}-{model_name.replace('/', '_')}-{chunker.chunk_tokens}t"
+    version_dir = os.path.join(out_dir, version)
+    os.makedirs(version_dir, exist_ok=True)
+
+    print(f"📚 Building knowledge index {version} from {source}")
+    chunks = []
+    vector_batches = []
+    with open(source, 'r', encoding='utf-8', errors='ignore') as f:
+        pieces = iter(lambda: f.read(64 * 1024), '')
+        for batch in iter_batches(chunker.iter_chunks(pieces), batch_size):
+            chunks.extend({'text': c['text'], 'start': c['start'], 'end': c['end']} for c in batch)
+            vectors = np.asarray(model.encode([c['text'] for c in batch], show_progress_bar=False), dtype=np.float32)
+            faiss.normalize_L2(vectors)
+            vector_batches.append(vectors)
+
+    index = build_index(np.vstack(vector_batches))
+    faiss.write_index(index, os.path.join(version_dir, INDEX_FILE))
+    with open(os.path.join(version_dir, CHUNKS_FILE), 'w', encoding='utf-8') as f:
+        json.dump(chunks, f, ensure_ascii=False)
+    with open(os.path.join(version_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump({
+            'version': version,
+            'source': os.path.basename(source),
+            'source_sha256': source_sha,
+            'model': model_name,
+            'chunk_tokens': chunker.chunk_tokens,
+            'chunks': len(chunks),
+            'built_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        }, f, indent=2)
+
+    # Flip CURRENT last, atomically, so a running service never sees a half-built version
+    current_path = os.path.join(out_dir, CURRENT_FILE)
+    with open(current_path + '.tmp', 'w') as f:
+        f.write(version)
+    os.replace(current_path + '.tmp', current_path)
+
+    print(f"✅ Knowledge index {version} built: {len(chunks)} chunks")
+    return version
+
+
+class KnowledgeIndex:
+    def __init__(self, manifest, chunks, index):
+        self.manifest = manifest
+        self.chunks = chunks
+        self.index = index
+
+    @property
+    def version(self):
+        return self.manifest.get('version')
+
+    @classmethod
+    def load(cls, out_dir=KNOWLEDGE_INDEX_DIR, model_name=None):
+        """mmap-load the CURRENT version, or return None if none is built or it was built for another model"""
+        try:
+            with open(os.path.join(out_dir, CURRENT_FILE)) as f:
+                version_dir = os.path.join(out_dir, f.read().strip())
+            with open(os.path.join(version_dir, MANIFEST_FILE), encoding='utf-8') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            print(f"⚠️ No knowledge index in {out_dir}; build one with: python knowledge_index.py")
+            return None
+
+        if model_name and manifest.get('model') != model_name:
+            print(f"⚠️ Knowledge index {manifest.get('version')} was built with {manifest.get('model')}, "
+                  f"not {model_name}; rebuild it with: python knowledge_index.py")
+            return None
+
+        with open(os.path.join(version_dir, CHUNKS_FILE), encoding='utf-8') as f:
+            chunks = json.load(f)
+        index, _ = read_index_mmap(os.path.join(version_dir, INDEX_FILE))
+
+        print(f"📚 Loaded knowledge index {manifest['version']} ({len(chunks)} chunks)")
+        return cls(manifest, chunks, index)
+
+    def is_stale(self, source=KNOWLEDGE_SOURCE):
+        try:
+            return _sha256_file(source) != self.manifest.get('source_sha256')
+        except FileNotFoundError:
+            return False
+
+    def search(self, query_embedding, top_k=3):
+        """Return [(score, chunk_text)] for a normalized (1, d) query embedding, best first"""
+        scores, indices = search_index(self.index, query_embedding, min(top_k, len(self.chunks)))
+        return [(float(score), self.chunks[idx]['text'])
+                for score, idx in zip(scores[0], indices[0]) if idx != -1]
+
+
+if __name__ == '__main__':
+    import argparse
+    from embedding_backend import load_embedding_model
+
+    parser = argparse.ArgumentParser(description="Build the global knowledge FAISS index")
+    parser.add_argument('--model', default='all-MiniLM-L6-v2')
+    parser.add_argument('--source', default=KNOWLEDGE_SOURCE)
+    parser.add_argument('--out', default=KNOWLEDGE_INDEX_DIR)
+    args = parser.parse_args()
+
+    build_knowledge_index(load_embedding_model(args.model), args.model, args.source, args.out)
@@ -0,0 +1,122 @@
+"""
+BM25 inverted index kept alongside a conversation's FAISS index, and reciprocal-rank
+fusion of its ranking with the dense one.
+Dense embeddings blur exact identifiers (section numbers, product codes, acronyms like
+DPDP or CKYCR); BM25 matches them literally, and RRF merges the two rankings without
+having to calibrate cosine similarity against BM25 scores.
+"""
+import os
+import re
+import sys
+import math
+import heapq
+from collections import Counter
+
+BM25_K1 = float(os.getenv('BM25_K1', '1.2'))
+BM25_B = float(os.getenv('BM25_B', '0.75'))
+RRF_K = int(os.getenv('RRF_K', '60'))
+
+# Identifiers keep their inner punctuation ("4.2", "v-kyc", "aes-256") and are also indexed by part
+_TOKEN_RE = re.compile(r"[^\W_]+(?:[._\-/][^\W_]+)*")
+_PART_SPLIT_RE = re.compile(r"[._\-/]")
+# CPython object sizes for nbytes(): a posting is a (position, tf) tuple plus its list slot (tfs are
+# small cached ints); a term adds its string, list and dict entry; a chunk its position and length
+# ints (one position int is shared by all of the chunk's postings) and its doc_lengths slot
+_POSTING_BYTES = sys.getsizeof((1000, 1)) + 9  # 8-byte slot plus list over-allocation
+_TERM_BYTES = sys.getsizeof([]) + 100  # Dict slot and hash-table share, amortized over growth
+_DOC_BYTES = 2 * sys.getsizeof(1000) + 9
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how in is it its of on or that the this to was "
+    "were what when where which who why will with about does do can".split()
+)
+
+
+def tokenize(text):
+    """Lowercased terms of text; compound identifiers are emitted whole and split into parts"""
+    terms = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in _STOPWORDS:
+            continue
+        terms.append(token)
+        if _PART_SPLIT_RE.search(token):
+            terms.extend(part for part in _PART_SPLIT_RE.split(token) if part and part not in _STOPWORDS)
+    return terms
+
+
+def analyze(texts):
+    """Per text, (term frequencies, length): the tokenizing half of BM25Index.add, safe to run before taking any lock"""
+    analyzed = []
+    for text in texts:
+        terms = tokenize(text)
+        analyzed.append((Counter(terms), len(terms)))
+    return analyzed
+
+
+class BM25Index:
+    """
+    Append-only inverted index over chunk positions, aligned with the chunk list the same way
+    the FAISS index is. Postings are appended in position order, so a reader that only knows
+    about the first n chunks can ignore anything past n.
+    """
+
+    def __init__(self, texts=()):
+        self.postings = {}  # term -> [(position, term frequency)]
+        self.doc_lengths = []
+        self.total_length = 0
+        self._nbytes = sys.getsizeof(self.postings) + sys.getsizeof(self.doc_lengths)
+        self.add(texts)
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, texts):
+        self.extend(analyze(texts))
+
+    def extend(self, analyzed):
+        """Append chunks already run through analyze()"""
+        for term_counts, length in analyzed:
+            position = len(self.doc_lengths)
+            for term, tf in term_counts.items():
+                postings = self.postings.get(term)
+                if postings is None:
+                    postings = self.postings[term] = []
+                    self._nbytes += sys.getsizeof(term) + _TERM_BYTES
+                postings.append((position, tf))
+            self._nbytes += len(term_counts) * _POSTING_BYTES + _DOC_BYTES
+            self.doc_lengths.append(length)
+            self.total_length += length
+
+    def search(self, query, k, limit=None):
+        """Return [(score, position)] of the k best BM25 matches among the first limit chunks"""
+        limit = len(self.doc_lengths) if limit is None else min(limit, len(self.doc_lengths))
+        if not limit:
+            return []
+        avg_length = (self.total_length / len(self.doc_lengths)) or 1.0
+
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1 + (len(self.doc_lengths) - df + 0.5) / (df + 0.5))
+            for position, tf in postings:
+                if position >= limit:
+                    break
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[position] / avg_length)
+                scores[position] = scores.get(position, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        return heapq.nlargest(k, ((score, position) for position, score in scores.items()))
+
+    def nbytes(self):
+        """Estimated memory footprint (CPython object sizes), for the conversation cache budget; O(1)"""
+        return self._nbytes
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Fuse ranked lists of positions (best first) into [(rrf_score, position)], best first"""
+    fused = {}
+    for ranking in rankings:
+        for rank, position in enumerate(ranking):
+            fused[position] = fused.get(position, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(((score, position) for position, score in fused.items()), reverse=True)
@@ -13,24 +13,32 @@ import sys
 import tempfile
 import io
 import traceback
+import uuid
+import threading
+import queue
 import numpy as np
 import faiss
 import re
-import PyPDF2
 from datetime import datetime
-from flask import Flask, request, jsonify
-from werkzeug.utils import secure_filename
+from flask import Flask, request, jsonify, Response, stream_with_context, copy_current_request_context
 from supabase import create_client, Client
 from dotenv import load_dotenv
 from urllib.parse import urlparse
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
 import time
-from google.generativeai import list_models
-import google.generativeai as genai
-from newspaper import Article
+from rag_store import DiskIndexStore, ConversationRAGCache, ConversationRAGState, ConversationLocks, valid_conversation_id
+from embedding_cache import EmbeddingCache
+from chunker import TokenChunker, iter_batches
+from knowledge_index import KnowledgeIndex
+from query_encoder import QueryEncoder
+from gemini_client import gemini_pool
+from embedding_backend import load_embedding_model
+from lexical_index import reciprocal_rank_fusion, analyze
+from index_factory import maybe_upgrade_index, remove_positions, search_index, index_tier, TIER_FLAT
+from document_extract import spool_upload, iter_document_text, extract_text
+from user_cache import UserCache
+from recent_messages import RecentMessages
+from message_journal import MessageJournal, MESSAGE_WRITE_BEHIND
+from ingest_jobs import IngestJob, IngestJobQueue, IngestQueueFull, STAGE_CHUNKING, STAGE_EMBEDDING, STAGE_EXTRACTING, STAGE_REMOVING, STAGE_DONE, STAGE_ERROR
 
 # Add this right after the RAG imports section:
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
@@ -39,9 +47,7 @@ os.environ["MKL_NUM_THREADS"] = "1"
 
 print("🔍 Checking RAG dependencies...")
 try:
-    from sentence_transformers import SentenceTransformer
-    print("✅ sentence_transformers imported successfully")
-
+    # The embedding model itself (torch or ONNX Runtime, see EMBEDDING_BACKEND) is imported when it loads
     import faiss
     print("✅ faiss imported successfully")
 
@@ -60,11 +66,24 @@ except ImportError as e:
 load_dotenv()
 
 # Initialize variables for web-only mode
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
 embedding_model = None
-conversation_documents = {}      # {conversation_id: [chunks]}
-conversation_embeddings = {}     # {conversation_id: np.array}
-conversation_faiss_index = {}    # {conversation_id: faiss.IndexFlatIP}
-document_usage_tracker = {}
+embedding_cache = None
+query_encoder = None
+knowledge_index = None
+# Minimum cosine similarity for the shared knowledge base to answer without a web search
+KNOWLEDGE_MIN_SCORE = float(os.getenv('KNOWLEDGE_MIN_SCORE', '0.55'))
+# Exchanges (user + assistant pairs) of history included in the conversation context
+CONTEXT_EXCHANGES = 7
+# Page sizes for /api/conversation/<id>/messages (limit/before cursor paging)
+MESSAGES_PAGE_SIZE = int(os.getenv('MESSAGES_PAGE_SIZE', '50'))
+MESSAGES_PAGE_SIZE_MAX = 500
+conversation_rag_cache = ConversationRAGCache()  # {conversation_id: ConversationRAGState}, LRU + byte budget
+# Queries read a conversation's state under its read lock; ingest swaps in a new state under the write lock
+conversation_locks = ConversationLocks()
+rag_index_store = DiskIndexStore()  # On-disk copy of the above, survives restarts and evictions
+# {conversation_id: True} until the first query after an upload; on disk so every worker process agrees
+document_usage_tracker = rag_index_store.flags('document_unused')
 
 print("✅ Backend starting in WEB-ONLY mode (RAG disabled)")
 
@@ -76,6 +95,15 @@ sys.stdout.flush()
 # FIXED: Conversation Manager with proper context handling
 class ConversationManager:
     def __init__(self):
+        # Cleared on the first save if supabase/append_messages.sql hasn't been run
+        self.rpc_available = True
+        # Whether messages has the client_id column from that script; probed on first use
+        self._client_ids = None
+        self.journal = None
+        # email -> users row; every conversation lookup starts from the user
+        self.user_cache = UserCache()
+        # Last CONTEXT_EXCHANGES exchanges per conversation, kept current by save_messages
+        self.recent = RecentMessages(window=CONTEXT_EXCHANGES * 2)
         supabase_url = os.getenv('SUPABASE_URL')
         supabase_key = os.getenv('SUPABASE_KEY')
 
@@ -90,22 +118,42 @@ class ConversationManager:
         except Exception as e:
             print(f"❌ Failed to connect to Supabase: {e}")
             self.supabase = None
+            return
+
+        if MESSAGE_WRITE_BEHIND:
+            try:
+                self.journal = MessageJournal(self.write_messages)
+                print(f"📒 Write-behind message journal at {self.journal.path}")
+            except Exception as e:
+                print(f"⚠️ Message journal unavailable, saving messages synchronously: {e}")
 
-    def create_or_get_user(self, email, username=None):
+    def create_or_get_user(self, email, username=None, create=True):
+        """Users row for email, from the user cache when possible; create=False only looks it up"""
         if not self.supabase:
             return None
 
+        cached, user = self.user_cache.get(email)
+        if cached and (user or not create):
+            return user
+
         try:
             result = self.supabase.table('users').select('*').eq('email', email).execute()
             if result.data:
+                self.user_cache.put(email, result.data[0])
                 return result.data[0]
+            if not create:
+                self.user_cache.put(email, None)
+                return None
 
             user_data = {'email': email}
             if username:
                 user_data['username'] = username
 
             result = self.supabase.table('users').insert(user_data).execute()
-            return result.data[0] if result.data else None
+            user = result.data[0] if result.data else None
+            if user:
+                self.user_cache.put(email, user)
+            return user
         except Exception as e:
             print(f"❌ Error creating/getting user: {e}")
             return None
@@ -146,77 +194,195 @@ class ConversationManager:
                 return result.data[0] if result.data else None
         except Exception as e:
             print(f"❌ Error getting/creating conversation: {e}")
+            # The cached user row may be stale (e.g. the user was deleted); look it up again next time
+            self.user_cache.invalidate(user_email)
             return None
 
-    def save_message(self, conversation_id, role, content, query_type=None, web_results=None, rag_context=None, ai_response=None):
-        if not self.supabase:
-            return None
+    @staticmethod
+    def message_row(role, content, query_type=None, web_results=None, rag_context=None, ai_response=None):
+        message_data = {'role': role, 'content': content}
+        if query_type:
+            message_data['query_type'] = query_type
+        if web_results:
+            message_data['web_results'] = web_results
+        if rag_context:
+            message_data['rag_context'] = rag_context
+        if ai_response:
+            message_data['ai_response'] = ai_response
+        return message_data
+
+    def has_client_ids(self):
+        """Whether messages has the client_id column added by supabase/append_messages.sql"""
+        if self._client_ids is None:
+            try:
+                self.supabase.table('messages').select('client_id').limit(1).execute()
+                self._client_ids = True
+            except Exception as e:
+                # Anything but a missing column (e.g. a network error) is decided on a later call
+                if 'client_id' not in str(e):
+                    raise
+                print("⚠️ messages.client_id is missing; run supabase/append_messages.sql so retried "
+                      "saves can't insert a message twice")
+                self._client_ids = False
+        return self._client_ids
+
+    def write_messages(self, conversation_id, messages):
+        """
+        Append messages (message_row dicts, in order) in one round trip through the
+        append_messages RPC (supabase/append_messages.sql), which allocates message_index
+        and updates the conversation atomically. Messages whose client_id is already stored
+        are skipped, so retrying a write is safe. Returns the saved rows; raises on failure.
+        """
+        if not self.has_client_ids():
+            messages = [{k: v for k, v in message.items() if k != 'client_id'} for message in messages]
+
+        if self.rpc_available:
+            try:
+                result = self.supabase.rpc('append_messages', {
+                    'p_conversation_id': conversation_id,
+                    'p_messages': messages
+                }).execute()
+                return result.data or []
+            except Exception as e:
+                # PGRST202: the function isn't deployed, stop trying it. Any other RPC error (a broken
+                # or outdated function) falls back for this call only, so messages still get saved
+                if 'PGRST202' in str(e) or 'Could not find the function' in str(e):
+                    print("⚠️ append_messages RPC not found, falling back to multi-call saves. "
+                          "Run supabase/append_messages.sql to enable atomic writes.")
+                    self.rpc_available = False
+                else:
+                    print(f"⚠️ append_messages RPC failed, falling back to multi-call save: {e}")
+
+        client_ids = [message['client_id'] for message in messages if message.get('client_id')]
+        if client_ids:
+            stored = self.supabase.table('messages').select('client_id').in_('client_id', client_ids).execute()
+            stored = {row['client_id'] for row in stored.data or []}
+            messages = [message for message in messages if message.get('client_id') not in stored]
+            if not messages:
+                return []
 
-        try:
-            count_result = self.supabase.table('messages').select('message_index').eq(
-                'conversation_id', conversation_id
-            ).order('message_index', desc=True).limit(1).execute()
-
-            message_index = 0
-            if count_result.data:
-                message_index = count_result.data[0]['message_index'] + 1
-
-            message_data = {
-                'conversation_id': conversation_id,
-                'role': role,
-                'content': content,
-                'message_index': message_index
-            }
+        count_result = self.supabase.table('messages').select('message_index').eq(
+            'conversation_id', conversation_id
+        ).order('message_index', desc=True).limit(1).execute()
 
-            if query_type:
-                message_data['query_type'] = query_type
-            if web_results:
-                message_data['web_results'] = web_results
-            if rag_context:
-                message_data['rag_context'] = rag_context
-            if ai_response:
-                message_data['ai_response'] = ai_response
+        message_index = 0
+        if count_result.data:
+            message_index = count_result.data[0]['message_index'] + 1
 
-            result = self.supabase.table('messages').insert(message_data).execute()
+        rows = [
+            dict(message, conversation_id=conversation_id, message_index=message_index + i)
+            for i, message in enumerate(messages)
+        ]
+        result = self.supabase.table('messages').insert(rows).execute()
 
-            self.supabase.table('conversations').update({
-                'total_messages': message_index + 1,
-                'last_message_at': datetime.now().isoformat()
-            }).eq('id', conversation_id).execute()
+        self.supabase.table('conversations').update({
+            'total_messages': message_index + len(rows),
+            'last_message_at': datetime.now().isoformat()
+        }).eq('id', conversation_id).execute()
+
+        return result.data or []
+
+    def save_messages(self, conversation_id, messages):
+        """Journal messages for the background flusher (write-behind), or write them straight to Supabase"""
+        if not self.supabase or not messages:
+            return []
+        # The key that makes a retried write (or a flush after a lost response) a no-op
+        messages = [dict(message, client_id=message.get('client_id') or str(uuid.uuid4())) for message in messages]
 
-            return result.data[0] if result.data else None
+        if self.journal:
+            try:
+                self.journal.append(conversation_id, messages)
+                self.recent.extend(conversation_id, messages)
+                return [dict(message, conversation_id=conversation_id) for message in messages]
+            except Exception as e:
+                print(f"⚠️ Message journal error, saving directly: {e}")
+
+        try:
+            saved = self.write_messages(conversation_id, messages)
+            self.recent.extend(conversation_id, messages)
+            return saved
         except Exception as e:
             print(f"❌ Error saving message: {e}")
-            return None
+            return []
+
+    def _with_unflushed(self, conversation_id, messages):
+        """Append the conversation's journaled messages that haven't reached Supabase yet"""
+        if not self.journal:
+            return messages
+        try:
+            pending = self.journal.pending(conversation_id)
+        except Exception as e:
+            print(f"⚠️ Message journal read error: {e}")
+            return messages
+        # An entry being flushed right now can already be in Supabase as well
+        flushed = {m.get('client_id') for m in messages if m.get('client_id')}
+        pending = [m for m in pending if m.get('client_id') not in flushed]
+        if not pending:
+            return messages
+
+        # Unflushed messages get the index they'll most likely be stored under
+        next_index = None
+        if not messages:
+            next_index = 0
+        elif messages[-1].get('message_index') is not None:
+            next_index = messages[-1]['message_index'] + 1
+        merged = list(messages)
+        for i, message in enumerate(pending):
+            message = dict(message, conversation_id=conversation_id)
+            if next_index is not None:
+                message['message_index'] = next_index + i
+            merged.append(message)
+        return merged
+
+    def save_message(self, conversation_id, role, content, query_type=None, web_results=None, rag_context=None,
+                     ai_response=None, user_message=None):
+        """Save one message; pass the exchange's user query as user_message to write both in the same insert"""
+        messages = [self.message_row(role, content, query_type, web_results, rag_context, ai_response)]
+        if user_message is not None:
+            messages.insert(0, self.message_row('user', user_message, 'general'))
+        saved = self.save_messages(conversation_id, messages)
+        return saved[-1] if saved else None
 
     # FIXED: Properly get conversation history for context
-    def get_conversation_history(self, conversation_id, limit=7):
+    def get_conversation_history(self, conversation_id, limit=CONTEXT_EXCHANGES):
         if not self.supabase:
             return []
 
         try:
-            result = self.supabase.table('messages').select(
-                'role, content, ai_response, created_at'
-            ).eq('conversation_id', conversation_id).order(
-                'message_index', desc=False
-            ).execute()
-
-            messages = result.data if result.data else []
-            # Return last few exchanges (user + assistant pairs)
-            return messages[-limit*2:] if len(messages) > limit*2 else messages
+            return self._fetch_history(conversation_id, limit)
         except Exception as e:
             print(f"❌ Error getting conversation history: {e}")
             return []
 
+    def _fetch_history(self, conversation_id, limit):
+        # Only the last limit exchanges (user + assistant pairs): fetch the tail newest-first, then reverse
+        columns = 'role, content, ai_response, client_id' if self.has_client_ids() else 'role, content, ai_response'
+        result = self.supabase.table('messages').select(columns).eq('conversation_id', conversation_id).order(
+            'message_index', desc=True
+        ).limit(limit * 2).execute()
+
+        messages = self._with_unflushed(conversation_id, list(reversed(result.data or [])))
+        return messages[-limit * 2:]
+
     # FIXED: Build proper context string that's actually used
-    def build_conversation_context(self, conversation_id):
+    def build_conversation_context(self, conversation_id, total_messages=None):
+        """total_messages (from the conversation row) tells whether the in-memory history is still current"""
         try:
-            history = self.get_conversation_history(conversation_id, limit=7)  # Last 7 exchanges
+            history = self.recent.get(conversation_id, total_messages)
+            if history is None:
+                if not self.supabase:
+                    return ""
+                history = self._fetch_history(conversation_id, CONTEXT_EXCHANGES)
+                self.recent.fill(conversation_id, history, total_messages)
+            else:
+                # Other workers' exchanges sit in the journal until flushed (indefinitely during a
+                # Supabase outage) without changing total_messages, so merge them here too
+                history = self._with_unflushed(conversation_id, history)[-CONTEXT_EXCHANGES * 2:]
             if not history:
                 return ""
 
             context_parts = []
-            for msg in history[-14:]:  # Last 14 messages max
+            for msg in history:
                 if msg['role'] == 'user':
                     context_parts.append(f"Previous User Question: {msg['content'][:150]}")
                 elif msg['role'] == 'assistant':
@@ -242,7 +408,8 @@ class ConversationManager:
             return []
 
         try:
-            user = self.create_or_get_user(user_email)
+            # Listing doesn't create users; an unknown email simply has no conversations
+            user = self.create_or_get_user(user_email, create=False)
             if not user:
                 return []
 
@@ -257,20 +424,69 @@ class ConversationManager:
             print(f"❌ Error getting conversations: {e}")
             return []
 
+    def get_conversation_messages_page(self, conversation_id, limit=MESSAGES_PAGE_SIZE, before=None):
+        """
+        One page of messages, oldest first: the `limit` messages before message_index `before`
+        (the newest page when before is None). Returns (messages, next_cursor); pass next_cursor
+        as before to get the previous page, it is None once the start of the conversation is reached.
+        """
+        if not self.supabase:
+            return [], None
+
+        try:
+            limit = max(1, min(int(limit), MESSAGES_PAGE_SIZE_MAX))
+            query = self.supabase.table('messages').select('*').eq('conversation_id', conversation_id)
+            if before is not None:
+                query = query.lt('message_index', int(before))
+            rows = query.order('message_index', desc=True).limit(limit).execute().data or []
+
+            messages = list(reversed(rows))
+            next_cursor = messages[0]['message_index'] if len(rows) == limit else None
+            if before is None:
+                messages = self._with_unflushed(conversation_id, messages)
+            return messages, next_cursor
+        except Exception as e:
+            print(f"❌ Error getting conversation messages: {e}")
+            return [], None
+
     def get_conversation_messages(self, conversation_id):
         if not self.supabase:
             return []
 
         try:
-            result = self.supabase.table('messages').select('*').eq(
-                'conversation_id', conversation_id
-            ).order('message_index', desc=False).execute()
+            # Keyset pages on message_index, so long chats aren't cut off at PostgREST's max-rows limit
+            messages = []
+            while True:
+                query = self.supabase.table('messages').select('*').eq('conversation_id', conversation_id)
+                if messages:
+                    query = query.gt('message_index', messages[-1]['message_index'])
+                rows = query.order('message_index', desc=False).limit(MESSAGES_PAGE_SIZE_MAX).execute().data or []
+                messages.extend(rows)
+                if len(rows) < MESSAGES_PAGE_SIZE_MAX:
+                    break
 
-            return result.data if result.data else []
+            return self._with_unflushed(conversation_id, messages)
         except Exception as e:
             print(f"❌ Error getting conversation messages: {e}")
             return []
 
+    def conversation_belongs_to(self, conversation_id, user_email):
+        """True if conversation_id is one of user_email's conversations (archived or not)"""
+        if not self.supabase or not user_email:
+            return False
+
+        try:
+            user = self.create_or_get_user(user_email, create=False)
+            if not user:
+                return False
+            result = self.supabase.table('conversations').select('id').eq(
+                'id', conversation_id
+            ).eq('user_id', user['id']).limit(1).execute()
+            return bool(result.data)
+        except Exception as e:
+            print(f"❌ Error checking conversation owner: {e}")
+            return False
+
     def archive_conversation(self, conversation_id):
         if not self.supabase:
             return False
@@ -279,6 +495,7 @@ class ConversationManager:
             self.supabase.table('conversations').update({
                 'is_archived': True
             }).eq('id', conversation_id).execute()
+            self.recent.evict(conversation_id)
             return True
         except Exception as e:
             print(f"❌ Error archiving conversation: {e}")
@@ -303,6 +520,9 @@ os.environ['GEMINI_API_KEY'] = os.getenv('GEMINI_API_KEY', 'AIzaSyDOmcCIWHcLM1Kp
 
 # Replace the call_GEMINI_ai function with this corrected version:
 
+# Set on the worker thread of a streaming /api/news request; call_gemini_ai pushes tokens into it
+_gemini_stream = threading.local()
+
 def call_gemini_ai(prompt, max_tokens=700):
     """Call Gemini AI API for intelligent response generation"""
     try:
@@ -314,9 +534,12 @@ def call_gemini_ai(prompt, max_tokens=700):
             print("❌ GEMINI_API_KEY not found in environment variables.")
             return None
 
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel("gemini-1.5-pro")
-        response = model.generate_content(prompt)
+        sink = getattr(_gemini_stream, 'sink', None)
+        if sink is not None:
+            return stream_gemini_ai(prompt, max_tokens, sink)
+
+        # Reused client and model; max_tokens caps the generation (it used to be ignored)
+        response = gemini_pool.generate(prompt, max_tokens=max_tokens)
         if hasattr(response, 'text'):
             print(f"✅ Gemini AI response received: {len(response.text)} characters")
             return response.text
@@ -330,6 +553,27 @@ def call_gemini_ai(prompt, max_tokens=700):
         return None
 
 
+def stream_gemini_ai(prompt, max_tokens, sink):
+    """generate_content(stream=True), forwarding each text chunk to sink as it arrives; returns the full text"""
+    # A request can generate more than once (e.g. a rejected knowledge-base answer falls back to
+    # web-only); a `reset` event tells the client to drop the tokens it has shown so far
+    if getattr(_gemini_stream, 'parts', None):
+        sink.put(('reset', {}))
+    parts = _gemini_stream.parts = []
+    for chunk in gemini_pool.generate(prompt, max_tokens=max_tokens, stream=True):
+        try:
+            text = chunk.text
+        except ValueError:
+            # Chunks without text parts (e.g. only safety ratings)
+            continue
+        if text:
+            parts.append(text)
+            sink.put(('token', text))
+    response = "".join(parts)
+    print(f"✅ Gemini AI streamed response: {len(response)} characters")
+    return response or None
+
+
 def call_gemini_ai_web_only(query, conversation_context=""):
     """
     Call Gemini AI for a direct answer to a user's query (web-only, no document context).
@@ -385,6 +629,37 @@ def call_gemini_ai_web_only(query, conversation_context=""):
 
 
 
+def call_gemini_ai_knowledge(query, knowledge_context, conversation_context=""):
+    """
+    Answer from the bundled knowledge base instead of a live web search.
+    Used when the knowledge index covers the question well enough.
+    """
+    print("📚 [Knowledge] Calling Gemini AI with knowledge base context...")
+
+    context_section = ""
+    if conversation_context and len(conversation_context.strip()) > 10:
+        context_section = f"\n\nPrevious Conversation Context:\n{conversation_context}\n"
+
+    prompt = (
+        f"You are an advanced, highly accurate, and reliable AI assistant. "
+        f"Answer the following user question with depth, clarity, and structure, "
+        f"using the reference material below as your primary source."
+        f"{context_section}\n\n"
+        f"User Question: \"{query}\"\n\n"
+        f"Reference Material:\n"
+        f"{knowledge_context}\n\n"
+        f"Instructions:\n"
+        f"1. Provide a direct, complete, and well-structured answer to the user's question.\n"
+        f"2. Use bullet points, numbered lists, tables or paragraphs as appropriate for clarity.\n"
+        f"3. Stay faithful to the reference material; do not invent figures, dates or penalties.\n"
+        f"4. If previous conversation context is provided, use it to make your answer more relevant and coherent.\n"
+        f"5. Always write in a professional, neutral, and helpful tone, formatted in markdown.\n"
+        f"---\n"
+        f"Answer:"
+    )
+    return call_gemini_ai(prompt, max_tokens=700)
+
+
 def generate_enhanced_fallback_response(query, web_results, rag_context, conversation_context=""):
     """Generate comprehensive fallback response when AI APIs fail"""
     print("🔄 Generating enhanced fallback response...")
@@ -421,27 +696,72 @@ def generate_enhanced_fallback_response(query, web_results, rag_context, convers
     else:
         return f"Based on available information about {query}, this topic encompasses several important aspects and considerations. Current research and analysis continue to provide insights into the various components and applications related to this subject."
 # FIXED: RAG setup with better implementation
-if RAG_AVAILABLE:
+# The embedding model (and torch with it) loads on a background thread, so Flask binds its port
+# and answers liveness probes straight away; /health/ready turns 200 once loading has finished.
+RAG_LOAD_IN_BACKGROUND = os.getenv('RAG_LOAD_IN_BACKGROUND', 'true').lower() == 'true'
+# How long an upload waits for the embedding model before failing
+RAG_READY_TIMEOUT_SECONDS = float(os.getenv('RAG_READY_TIMEOUT_SECONDS', '300'))
+rag_ready = threading.Event()
+rag_load_error = None
+rag_load_seconds = None
+
+def load_rag_models():
+    """Load the embedding model, embedding cache and knowledge index, then set rag_ready"""
+    global RAG_AVAILABLE, embedding_model, query_encoder, embedding_cache, knowledge_index
+    global rag_load_error, rag_load_seconds
+    started = time.time()
     try:
         print("🧠 Loading embedding model...")
-        embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-        document_store = []
-        document_embeddings = None
-        faiss_index = None
-        print("✅ RAG embedding model loaded successfully")
+        embedding_model = load_embedding_model(EMBEDDING_MODEL_NAME)
+        query_encoder = QueryEncoder(embedding_model)
+        try:
+            embedding_cache = EmbeddingCache(EMBEDDING_MODEL_NAME)
+        except Exception as e:
+            print(f"⚠️ Embedding cache unavailable, every upload will be encoded: {e}")
+            embedding_cache = None
+        try:
+            knowledge_index = KnowledgeIndex.load(model_name=EMBEDDING_MODEL_NAME)
+            if knowledge_index and knowledge_index.is_stale():
+                print("⚠️ Knowledge file changed since the index was built; rebuild with: python knowledge_index.py")
+        except Exception as e:
+            print(f"⚠️ Knowledge index unavailable: {e}")
+            knowledge_index = None
+        print(f"✅ RAG embedding model loaded successfully in {time.time() - started:.1f}s")
     except Exception as e:
         print(f"❌ Failed to load embedding model: {e}")
         RAG_AVAILABLE = False
         embedding_model = None
-        document_store = []
-        document_embeddings = None
-        faiss_index = None
+        query_encoder = None
+        rag_load_error = str(e)
         print("⚠️ Falling back to web-only mode")
+    finally:
+        rag_load_seconds = round(time.time() - started, 2)
+        rag_ready.set()
+
+def rag_status():
+    """'disabled', 'loading', 'ready' or 'failed', plus what was loaded"""
+    if not rag_ready.is_set():
+        state = 'loading'
+    elif rag_load_error:
+        state = 'failed'
+    elif not RAG_AVAILABLE:
+        state = 'disabled'
+    else:
+        state = 'ready'
+    return {
+        'state': state,
+        'embedding_backend': type(embedding_model).__name__ if embedding_model else None,
+        'knowledge_index_version': knowledge_index.version if knowledge_index else None,
+        'load_seconds': rag_load_seconds,
+        'error': rag_load_error
+    }
+
+if not RAG_AVAILABLE:
+    rag_ready.set()
+elif RAG_LOAD_IN_BACKGROUND:
+    threading.Thread(target=load_rag_models, name='rag-model-loader', daemon=True).start()
 else:
-    embedding_model = None
-    document_store = []
-    document_embeddings = None
-    faiss_index = None
+    load_rag_models()
 
 app = Flask(__name__)
 # REPLACE line 375-385 CORS configuration with this FLEXIBLE version:
@@ -471,6 +791,18 @@ ALLOWED_EXTENSIONS = {'txt', 'pdf', 'doc', 'docx', 'md'}
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+ingest_queue = IngestJobQueue()
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', '64'))
+document_chunker = None
+
+def get_document_chunker():
+    """Token-aware chunker that counts tokens with the embedding model's own tokenizer"""
+    global document_chunker
+    if document_chunker is None:
+        document_chunker = TokenChunker(getattr(embedding_model, 'tokenizer', None))
+    return document_chunker
+# How long /api/news waits for a conversation's in-flight upload before answering without it
+INGEST_QUERY_WAIT_SECONDS = float(os.getenv('INGEST_QUERY_WAIT_SECONDS', '5'))
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -478,89 +810,12 @@ def allowed_file(filename):
 def extract_text_from_file(file_content, filename):
     """Extract text from various file formats"""
     try:
-        filename_lower = filename.lower()
-
-        if filename_lower.endswith('.txt') or filename_lower.endswith('.md'):
-            return file_content
-
-        elif filename_lower.endswith('.pdf'):
-            try:
-                import PyPDF2
-                import io
-                text = ""
-                pdf_bytes = file_content if isinstance(file_content, bytes) else file_content.encode('utf-8')
-                pdf_file = io.BytesIO(pdf_bytes)
-                reader = PyPDF2.PdfReader(pdf_file)
-                for page in reader.pages:
-                    text += page.extract_text() + "\n"
-                return text
-            except ImportError:
-                return "PDF processing requires PyPDF2. Install with: pip install PyPDF2"
-
-        elif filename_lower.endswith('.docx'):
-            try:
-                from docx import Document
-                import io
-                docx_bytes = file_content if isinstance(file_content, bytes) else file_content.encode('utf-8')
-                doc_file = io.BytesIO(docx_bytes)
-                doc = Document(doc_file)
-                text = ""
-                for paragraph in doc.paragraphs:
-                    text += paragraph.text + "\n"
-                return text
-            except ImportError:
-                return "DOCX processing requires python-docx. Install with: pip install python-docx"
-
-        else:
-            return file_content
-
+        return extract_text(file_content, filename)
+    except ImportError as e:
+        return f"Document processing requires an extra package ({e}). Install PyPDF2 / python-docx."
     except Exception as e:
         return f"Error reading file: {str(e)}"
 
-# FIXED: RAG Functions with better implementation
-# Replace the process_document function:
-
-def process_document(text, chunk_size=500):
-    print(f"🔍 Processing document: {len(text)} chars, chunk_size={chunk_size}")
-
-    if not text:
-        print("❌ Empty text provided")
-        return []
-
-    chunks = []
-    print("🔄 Splitting into paragraphs...")
-    paragraphs = text.split('\n\n')
-    print(f"📋 Found {len(paragraphs)} paragraphs")
-
-    for i, paragraph in enumerate(paragraphs):
-        if len(paragraph.strip()) > 0:
-            if len(paragraph) > chunk_size:
-                print(f"📏 Paragraph {i} too long ({len(paragraph)} chars), splitting by sentences...")
-                sentences = paragraph.split('. ')
-                current_chunk = ""
-
-                for sentence in sentences:
-                    if len(current_chunk + sentence) < chunk_size:
-                        current_chunk += sentence + ". "
-                    else:
-                        if current_chunk:
-                            chunks.append(current_chunk.strip())
-                        current_chunk = sentence + ". "
-
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-            else:
-                chunks.append(paragraph.strip())
-
-    print(f"✅ Created {len(chunks)} chunks")
-    if chunks:
-        print(f"📝 First chunk preview: {chunks[0][:100]}...")
-        print(f"📏 Chunk lengths: {[len(c) for c in chunks[:5]]}");  # Show first 5 lengths
-
-    return chunks
-
-
-
 #patterns for summary detection
 # This function checks if a query is likely asking for a document summary
 # It uses regex patterns to identify common phrases and keywords associated with summary requests.
@@ -817,93 +1072,278 @@ def is_document_summary_query(query):
 
 
 
-def add_document_to_rag_simple(document_text, filename="uploaded_doc", conversation_id=None):
-    """Simplified RAG for large documents"""
-    global conversation_documents, conversation_embeddings, conversation_faiss_index
+def encode_chunk_texts(texts, out=None):
+    """
+    Embed chunk texts as float32, into out (a preallocated (len(texts), dim) array) when given.
+    Chunks seen before in any conversation come from the shared cache.
+    """
+    if embedding_cache:
+        return embedding_cache.encode(embedding_model, texts, out=out, batch_size=EMBED_BATCH_SIZE)
+    vectors = embedding_model.encode(texts, batch_size=EMBED_BATCH_SIZE, show_progress_bar=False, convert_to_numpy=True)
+    if out is None:
+        return np.asarray(vectors, dtype=np.float32)
+    out[:] = vectors
+    return out
+
+def add_document_to_rag_simple(document_text, filename="uploaded_doc", conversation_id=None, doc_id=None, job=None):
+    """
+    Simplified RAG for large documents. Appends to the conversation's existing chunks and index.
+    document_text is either a string or an iterable of text pieces (e.g. PDF pages) consumed lazily;
+    chunks stream from the chunker to the embedder in batches of EMBED_BATCH_SIZE, each written
+    into one reused float32 buffer and added to the index, so memory stays flat however long the
+    document is.
+    """
+    # Appends are read-modify-write of the stored index; serialize them across worker processes
+    with rag_index_store.write_lock(conversation_id):
+        return _append_document_to_rag(document_text, filename, conversation_id, doc_id, job)
 
-    print(f"🔄 Simple RAG processing: {filename} ({len(document_text)} chars) for conversation {conversation_id}")
+def _append_document_to_rag(document_text, filename, conversation_id, doc_id, job):
+    print(f"🔄 Simple RAG processing: {filename} for conversation {conversation_id}")
 
     try:
-        # Create smaller, meaningful chunks
-        chunks = []
-
-        # Split by paragraphs and sentences more aggressively
-        paragraphs = document_text.split('\n\n')
-        for paragraph in paragraphs:
-            if len(paragraph.strip()) > 100:  # Only meaningful paragraphs
-                if len(paragraph) > 400:  # Split long paragraphs
-                    sentences = paragraph.split('. ')
-                    current_chunk = ""
-                    for sentence in sentences:
-                        if len(current_chunk + sentence) < 400:
-                            current_chunk += sentence + ". "
-                        else:
-                            if len(current_chunk.strip()) > 50:
-                                chunks.append(current_chunk.strip())
-                            current_chunk = sentence + ". "
-                    if len(current_chunk.strip()) > 50:
-                        chunks.append(current_chunk.strip())
-                else:
-                    chunks.append(paragraph.strip())
+        if job:
+            job.update(stage=STAGE_CHUNKING)
+
+        pieces = [document_text] if isinstance(document_text, str) else document_text
+        characters = 0
+        visible_characters = 0
+
+        def counted(pieces):
+            nonlocal characters, visible_characters
+            for piece in pieces:
+                characters += len(piece)
+                visible_characters += len(piece.strip())
+                yield piece
+
+        doc_id = doc_id or uuid.uuid4().hex
+        indexing = RAG_AVAILABLE and embedding_model is not None
+
+        # Append to whatever this conversation already has; earlier uploads stay searchable.
+        # Vectors go into a private copy of the index, so queries keep searching the published
+        # one until the new (chunks, index) pair is swapped in at the end.
+        existing = load_conversation_rag(conversation_id)
+        previous_chunks = existing.chunks if existing else []
+        index = None
+        if indexing:
+            index = existing.writable_index() if existing else None
+            if index is not None and index.ntotal != len(previous_chunks):
+                # Text-only leftovers have no vectors; start over with just this document
+                index, previous_chunks = None, []
+
+        chunk_records = []
+        batch_buffer = None
+        chunks = get_document_chunker().iter_chunks(counted(pieces))
+        for batch in iter_batches(chunks, EMBED_BATCH_SIZE):
+            chunk_records.extend(
+                {'text': c['text'], 'filename': filename, 'doc_id': doc_id, 'start': c['start'], 'end': c['end']}
+                for c in batch
+            )
+            if not indexing:
+                continue
 
-        # Limit chunks to avoid memory issues
-        if len(chunks) > 200:
-            print(f"📏 Limiting to first 200 chunks (was {len(chunks)})")
-            chunks = chunks[:200]
+            if job:
+                job.update(stage=STAGE_EMBEDDING)
+            # The index keeps its own copy of the vectors, so one batch-sized buffer is reused throughout
+            texts = [c['text'] for c in batch]
+            if batch_buffer is None:
+                embeddings = encode_chunk_texts(texts)
+                batch_buffer = np.empty((EMBED_BATCH_SIZE, embeddings.shape[1]), dtype=np.float32)
+            else:
+                embeddings = encode_chunk_texts(texts, out=batch_buffer[:len(texts)])
+            faiss.normalize_L2(embeddings)
+            if index is None:
+                index = faiss.IndexFlatIP(embeddings.shape[1])
+            index.add(embeddings)
+            if job:
+                job.update(chunks_embedded=len(chunk_records))
+
+        if job:
+            job.update(characters=characters, chunks_total=len(chunk_records))
+        if visible_characters < 10:
+            raise ValueError("File appears to be empty")
+        print(f"✅ Created {len(chunk_records)} chunks for processing")
+        if not chunk_records:
+            raise ValueError("No indexable text found in document")
+
+        all_chunks = previous_chunks + chunk_records
+        if not indexing:
+            publish_conversation_rag(conversation_id, ConversationRAGState(all_chunks), document_added=True)
+            return True, f"Added {len(chunk_records)} chunks (text-only mode)"
+
+        # Switch to HNSW / IVF-PQ once the conversation has outgrown exact search
+        index = maybe_upgrade_index(index)
+
+        disk_version = None
+        try:
+            disk_version = rag_index_store.save(conversation_id, all_chunks, index)
+        except Exception as e:
+            print(f"⚠️ Could not persist RAG index for conversation {conversation_id}: {e}")
 
-        print(f"✅ Created {len(chunks)} chunks for processing")
+        state = ConversationRAGState(all_chunks, index, disk_version=disk_version)
+        # BM25 postings are append-only, so extend them (under the write lock) when they cover the previous chunks;
+        # the new chunks are tokenized first, outside the lock
+        lexical = existing.lexical if existing and previous_chunks else None
+        new_terms = None
+        if lexical is not None and len(lexical) == len(previous_chunks):
+            state.lexical = lexical
+            new_terms = analyze(c['text'] for c in chunk_records)
+        publish_conversation_rag(conversation_id, state, document_added=True, new_terms=new_terms)
 
-        # Always overwrite previous document chunks for this conversation
-        conversation_documents[conversation_id] = [{'text': chunk, 'filename': filename} for chunk in chunks]
+        return True, f"Added {len(chunk_records)} chunks successfully ({len(all_chunks)} total)"
 
-        if not RAG_AVAILABLE or not embedding_model:
-            return True, f"Added {len(chunks)} chunks (text-only mode)"
+    except Exception as e:
+        # Nothing was published; the partly filled copy of the index is simply dropped
+        print(f"❌ Simple RAG failed: {e}")
+        return False, f"Processing error: {str(e)}"
 
-        batch_emb = embedding_model.encode(chunks, show_progress_bar=False)
-        new_embeddings = np.vstack([batch_emb])
+def encode_query(query):
+    """Normalized (1, d) float32 embedding of a search query, cached and micro-batched"""
+    return query_encoder.encode(query)
 
-        # Always overwrite embeddings and FAISS index for this conversation
-        conversation_embeddings[conversation_id] = new_embeddings.astype(np.float32)
+def search_knowledge(query, top_k=3):
+    """Search the shared knowledge index; returns (context, best_score) or ("", 0.0)"""
+    if not knowledge_index or not embedding_model:
+        return "", 0.0
+    try:
+        results = knowledge_index.search(encode_query(query), top_k)
+    except Exception as e:
+        print(f"❌ Knowledge search error: {e}")
+        return "", 0.0
+    if not results:
+        return "", 0.0
+    best_score = results[0][0]
+    context = "\n\n".join(text for score, text in results if score >= KNOWLEDGE_MIN_SCORE * 0.8)
+    print(f"📚 Knowledge search best score: {best_score:.3f}")
+    return context, best_score
+
+def publish_conversation_rag(conversation_id, state, document_added=False, new_terms=None):
+    """
+    Swap in a conversation's new (chunks, index) state in one step under its write lock, so a
+    query sees either the old pair or the new one, never a mix. The "document just uploaded"
+    flag is set inside the same lock.
+    """
+    with conversation_locks(conversation_id).write():
+        if new_terms:
+            state.lexical.extend(new_terms)
+            state.refresh_nbytes()
+        conversation_rag_cache.put(conversation_id, state)
+        if document_added:
+            document_usage_tracker[conversation_id] = True
+
+def load_conversation_rag(conversation_id):
+    """Return a conversation's RAG state, mmap-loading it from disk on first use or after eviction"""
+    if not valid_conversation_id(conversation_id):
+        return None
 
-        dimension = new_embeddings.shape[1]
-        conversation_faiss_index[conversation_id] = faiss.IndexFlatIP(dimension)
-        faiss.normalize_L2(conversation_embeddings[conversation_id])
-        conversation_faiss_index[conversation_id].reset()
-        conversation_faiss_index[conversation_id].add(conversation_embeddings[conversation_id])
+    state = conversation_rag_cache.get(conversation_id)
+    if state:
+        if state.disk_version is None:
+            return state  # Never persisted (text-only mode or a failed save); this process owns it
+        # Another worker process may have appended to or removed from this conversation
+        disk_version = rag_index_store.version(conversation_id)
+        if disk_version == state.disk_version:
+            return state
+        conversation_rag_cache.evict(conversation_id)
+        if disk_version is None:
+            return None
 
-        return True, f"Added {len(chunks)} chunks successfully"
+    stored = rag_index_store.load(conversation_id)
+    if not stored:
+        return None
 
-    except Exception as e:
-        print(f"❌ Simple RAG failed: {e}")
-        return False, f"Processing error: {str(e)}"
+    chunks, index, disk_version, mmapped = stored
+    state = ConversationRAGState(chunks, index, mmapped=mmapped, disk_version=disk_version)
+    conversation_rag_cache.put(conversation_id, state)
+    return state
+
+def remove_document_from_rag(conversation_id, doc_id):
+    """Drop one uploaded document's chunks and vectors from a conversation"""
+    with rag_index_store.write_lock(conversation_id):
+        return _remove_document_from_rag(conversation_id, doc_id)
+
+def _remove_document_from_rag(conversation_id, doc_id):
+    state = load_conversation_rag(conversation_id)
+    if not state:
+        return False, "No documents uploaded for this conversation"
+
+    positions = [i for i, chunk in enumerate(state.chunks) if chunk.get('doc_id') == doc_id]
+    if not positions:
+        return False, f"Document {doc_id} not found"
+
+    remaining = [chunk for chunk in state.chunks if chunk.get('doc_id') != doc_id]
+    if not remaining:
+        with conversation_locks(conversation_id).write():
+            conversation_rag_cache.evict(conversation_id)
+            rag_index_store.delete(conversation_id)
+        return True, "Removed document; conversation has no documents left"
+
+    index = state.writable_index()
+    disk_version = None
+    if index is not None:
+        # Remaining vectors keep their order, so positions stay aligned with the chunk list
+        index = remove_positions(index, positions)
+        disk_version = rag_index_store.save(conversation_id, remaining, index)
+
+    publish_conversation_rag(conversation_id, ConversationRAGState(remaining, index, disk_version=disk_version))
+    return True, f"Removed {len(positions)} chunks"
+
+def get_conversation_chunks(conversation_id):
+    """Chunk list of the conversation's current state; callers take the read lock if they need it consistent with other reads"""
+    state = load_conversation_rag(conversation_id)
+    return state.chunks if state else []
+
+# Hybrid retrieval: fuse BM25 and dense rankings; each side contributes this many candidates
+HYBRID_SEARCH_DEFAULT = os.getenv('HYBRID_SEARCH', 'true').lower() == 'true'
+HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', '20'))
+
+def rank_chunks(state, query, query_embedding, top_k=3, nprobe=None, ef_search=None, hybrid=None):
+    """
+    Return up to top_k chunk positions, best first. Dense-only keeps the old
+    similarity > 0.10 cutoff; hybrid mode fuses the dense and BM25 rankings with RRF,
+    so exact identifiers the embedding misses can still surface.
+    """
+    if hybrid is None:
+        hybrid = HYBRID_SEARCH_DEFAULT
+    n_chunks = len(state.chunks)
+    candidates = min(max(top_k, HYBRID_CANDIDATES) if hybrid else top_k, n_chunks)
 
-# FIXED: Better RAG search with structured results
-def search_documents(query, top_k=3, conversation_id=None):
-    global conversation_documents, conversation_embeddings, conversation_faiss_index
+    # nprobe / ef_search only matter once the conversation has been upgraded to an ANN index
+    scores, indices = search_index(state.index, query_embedding, candidates, nprobe, ef_search)
+    dense_ranking = [int(idx) for score, idx in zip(scores[0], indices[0]) if idx != -1 and score > 0.10]
+    if not hybrid:
+        return dense_ranking[:top_k]
+
+    lexical_ranking = [position for score, position in state.lexical_index().search(query, candidates, limit=n_chunks)]
+    fused = reciprocal_rank_fusion([dense_ranking, lexical_ranking])
+    return [position for score, position in fused[:top_k]]
 
-    if not conversation_id or conversation_id not in conversation_documents:
+# FIXED: Better RAG search with structured results
+def search_documents(query, top_k=3, conversation_id=None, nprobe=None, ef_search=None, hybrid=None):
+    # Shortly after startup the embedding model may still be loading; give it a moment
+    rag_ready.wait(INGEST_QUERY_WAIT_SECONDS)
+    state = load_conversation_rag(conversation_id)
+    if not state:
         return "No documents uploaded yet for this conversation."
 
-    if not RAG_AVAILABLE or not embedding_model or conversation_id not in conversation_faiss_index:
+    if not RAG_AVAILABLE or not embedding_model or state.index is None:
         return "No documents uploaded yet for this conversation."
 
     try:
-        query_embedding = embedding_model.encode([query])
-        faiss.normalize_L2(query_embedding)
-
-        index = conversation_faiss_index[conversation_id]
-        docs = conversation_documents[conversation_id]
-        embeddings = conversation_embeddings[conversation_id]
-
-        scores, indices = index.search(query_embedding, min(top_k, len(docs)))
+        # Encode before taking the lock, so a pending swap never waits on the model
+        query_embedding = encode_query(query)
 
         results = []
-        for i in range(len(indices[0])):
-            if indices[0][i] != -1 and scores[0][i] > 0.10:
-                doc_idx = indices[0][i]
+        with conversation_locks(conversation_id).read():
+            # Re-read under the lock: an upload may have swapped in a new state meanwhile
+            state = load_conversation_rag(conversation_id) or state
+            docs = state.chunks
+            positions = rank_chunks(state, query, query_embedding, top_k, nprobe, ef_search, hybrid)
+            for doc_idx in positions:
                 doc_text = docs[doc_idx]['text']
                 if len(doc_text) > 30:
                     results.append(doc_text[:300])
+        # A first hybrid search builds the BM25 postings; charge them to the cache budget
+        conversation_rag_cache.resize(conversation_id, state)
 
         if results:
             return " | ".join(results)
@@ -1512,6 +1952,38 @@ def generate_guaranteed_fallback_response(query, web_results, rag_context, conve
 # API Routes
 
 
+def run_upload_ingest(job, spooled_file):
+    """Extract, chunk and embed one uploaded file. Runs on the ingest worker pool, not the request thread."""
+    try:
+        # Uploads that arrive while the model is still loading wait here rather than being stored text-only
+        if not rag_ready.wait(RAG_READY_TIMEOUT_SECONDS):
+            raise RuntimeError('Embedding model is still loading, please try again shortly')
+        if not RAG_AVAILABLE or not embedding_model:
+            raise RuntimeError('Document upload is unavailable: the embedding model failed to load')
+        job.update(stage=STAGE_EXTRACTING)
+
+        def page_progress(pages_processed, pages_total):
+            job.update(pages_processed=pages_processed, pages_total=pages_total)
+
+        # Pages are pulled lazily by the chunker, so only a few are ever in memory at once
+        pages = iter_document_text(spooled_file, job.filename, progress=page_progress)
+        success, message = add_document_to_rag_simple(pages, job.filename, job.conversation_id, job.doc_id, job=job)
+    finally:
+        spooled_file.close()
+
+    if not success:
+        raise RuntimeError(f'Processing failed: {message}')
+
+    return f'File "{job.filename}" uploaded successfully. {message}'
+
+def run_document_removal(job):
+    """Remove one document and rebuild its conversation's ANN index. Runs on the ingest worker pool."""
+    job.update(stage=STAGE_REMOVING)
+    success, message = remove_document_from_rag(job.conversation_id, job.doc_id)
+    if not success:
+        raise RuntimeError(message)
+    return message
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     print('📤 Upload request received!')
@@ -1519,6 +1991,8 @@ def upload_file():
         conversation_id = request.form.get('conversation_id')
         if not conversation_id:
             return jsonify({'status': 'error', 'error': 'Missing conversation_id'}), 400
+        if not valid_conversation_id(conversation_id):
+            return jsonify({'status': 'error', 'error': 'Invalid conversation_id'}), 400
         if 'file' not in request.files:
             return jsonify({'status': 'error', 'error': 'No file provided'}), 400
 
@@ -1531,69 +2005,108 @@ def upload_file():
             return jsonify({'status': 'error', 'error': 'File type not allowed. Use txt, pdf, doc, docx, or md files.'}), 400
 
                # Handle RAG availability
-        if not RAG_AVAILABLE or not embedding_model:
+        # While the model is still loading the job waits for it (run_upload_ingest); only refuse
+        # once RAG is known to be off or the model failed to load
+        if not RAG_AVAILABLE or (rag_ready.is_set() and not embedding_model):
             print("⚠️ RAG is disabled - file upload not supported")
             return jsonify({
                 'status': 'error',
                 'error': 'Document upload is temporarily disabled. The system is running in web-only mode.'
             }), 400
 
-        # Extract text content
+        # The request stream is gone once we return, so the upload is spooled here
+        # (in memory, or a temp file for big ones) and extraction/chunking/embedding
+        # happen on the ingest worker pool.
+        spooled_file = spool_upload(file)
+        job = IngestJob(conversation_id, file.filename)
         try:
-            if file.filename.lower().endswith(('.txt', '.md')):
-                file_content = file.read().decode('utf-8', errors='ignore')
-                text_content = file_content
-            else:
-                filename = secure_filename(file.filename)
-                temp_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(temp_path)
-
-                with open(temp_path, 'rb') as f:
-                    file_bytes = f.read()
+            ingest_queue.submit(job, run_upload_ingest, spooled_file)
+        except IngestQueueFull as e:
+            spooled_file.close()
+            return jsonify({'status': 'error', 'error': str(e)}), 503
 
-                if filename.lower().endswith('.pdf'):
-                    try:
-                        import PyPDF2
-                        import io
-                        pdf_file = io.BytesIO(file_bytes)
-                        reader = PyPDF2.PdfReader(pdf_file)
-                        text_content = ""
-                        for page in reader.pages:
-                            text_content += page.extract_text() + "\n"
-                    except ImportError:
-                        return jsonify({'status': 'error', 'error': 'PDF processing requires PyPDF2'}), 400
-                else:
-                    text_content = file_bytes.decode('utf-8', errors='ignore')
-
-                os.remove(temp_path)
-
-            if len(text_content.strip()) < 10:
-                return jsonify({'status': 'error', 'error': 'File appears to be empty'}), 400
-              # Process with RAG
-            success, message = add_document_to_rag_simple(text_content, file.filename, conversation_id)
-
-            if success:
-                document_usage_tracker[conversation_id] = True
-                return jsonify({
-                    'status': 'success',
-                    'message': f'File "{file.filename}" uploaded successfully. {message}',
-                    'filename': file.filename,
-                    'characters': len(text_content)
-                })
-            else:
-                return jsonify({'status': 'error', 'error': f'Processing failed: {message}'}), 500
-
-        except Exception as e:
-            return jsonify({'status': 'error', 'error': f'Error: {str(e)}'}), 400
+        print(f"📥 Queued ingest job {job.job_id} for {file.filename}")
+        return jsonify({
+            'status': 'processing',
+            'message': f'File "{file.filename}" received, processing in the background.',
+            'job_id': job.job_id,
+            'doc_id': job.doc_id,
+            'filename': file.filename,
+            'progress_url': f'/upload/{job.job_id}'
+        }), 202
 
     except Exception as e:
         print(f'❌ Upload error: {e}')
         return jsonify({'status': 'error', 'error': f'Upload failed: {str(e)}'}), 500
 
+@app.route('/upload/<job_id>', methods=['GET'])
+def upload_progress(job_id):
+    job = ingest_queue.get(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'error': 'Unknown or expired upload job'}), 404
+
+    job_info = job.to_dict()
+    if job.stage == STAGE_DONE:
+        job_info['status'] = 'success'
+    elif job.stage == STAGE_ERROR:
+        job_info['status'] = 'error'
+    else:
+        job_info['status'] = 'processing'
+    return jsonify(job_info)
+
 # Replace the handle_universal_search function:
 
 
 
+@app.route('/api/news/stream', methods=['POST'])
+def handle_universal_search_stream():
+    """
+    Server-sent-events variant of /api/news, same request body. Emits `token` events with
+    Gemini's text as it is generated, then one `done` event carrying the full /api/news JSON
+    (result, mode, debug_info...), or an `error` event. A `reset` event means the tokens sent
+    so far are discarded (a new generation starts, or done's result differs from them). The message is saved once the
+    generation has finished, exactly as /api/news does.
+    """
+    events = queue.Queue()
+
+    @copy_current_request_context
+    def run():
+        _gemini_stream.sink = events
+        try:
+            response = handle_universal_search()
+            if isinstance(response, tuple):
+                response = response[0]
+            payload = response.get_json()
+            # The returned result isn't always the streamed text (short answers are replaced, failed
+            # generations fall back), so clear it first and let the client show done's result
+            streamed = "".join(getattr(_gemini_stream, 'parts', None) or [])
+            if streamed and payload.get('result') != streamed:
+                events.put(('reset', {}))
+            events.put(('error' if payload.get('status') == 'error' else 'done', payload))
+        except Exception as e:
+            events.put(('error', {'status': 'error', 'error': str(e)}))
+        finally:
+            _gemini_stream.sink = None
+            _gemini_stream.parts = None
+            events.put(None)
+
+    # The search runs on its own thread, so it completes and saves even if the client disconnects
+    threading.Thread(target=run, name='news-stream', daemon=True).start()
+
+    def event_stream():
+        # Send something immediately so proxies and the browser see the first byte right away
+        yield "retry: 3000\n\n"
+        while True:
+            item = events.get()
+            if item is None:
+                break
+            event, payload = item
+            data = json.dumps({'text': payload} if event == 'token' else payload)
+            yield f"event: {event}\ndata: {data}\n\n"
+
+    return Response(stream_with_context(event_stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/news', methods=['POST'])
 def handle_universal_search():
     print("==== /api/news endpoint called ====")
@@ -1603,6 +2116,11 @@ def handle_universal_search():
         query = data.get('query', 'latest information')
         user_email = data.get('user_email', 'anonymous@example.com')
         conversation_id = data.get('conversation_id')
+        # Optional per-request ANN knobs for large document sets
+        nprobe = data.get('nprobe')
+        ef_search = data.get('ef_search')
+        # Optional per-request switch between hybrid (BM25 + dense) and dense-only document search
+        hybrid = data.get('hybrid')
 
         print(f"📋 Processing query: {query}")
         print(f"👤 User: {user_email}")
@@ -1618,7 +2136,6 @@ def handle_universal_search():
                     result = conversation_manager.supabase.table('conversations').select('*').eq('id', conversation_id).single().execute()
                     if result.data:
                         conversation = result.data
-                        conversation_context = conversation_manager.build_conversation_context(conversation['id'])
                         print(f"✅ Using existing conversation: {conversation['id']}")
                     else:
                         print(f"❌ Conversation {conversation_id} not found, creating new one")
@@ -1626,11 +2143,12 @@ def handle_universal_search():
                 else:
                     print("🆕 No conversation ID provided, getting or creating conversation")
                     conversation = conversation_manager.get_or_create_conversation(user_email, force_new=False)
+                # The user message is saved together with the answer (save_message(user_message=query)),
+                # one insert per exchange instead of one per message
                 if conversation:
-                    conversation_manager.save_message(conversation['id'], 'user', query, 'general')
-                    print(f"  Saved user message to conversation: {conversation['id']}")
-                    if not conversation_context:
-                        conversation_context = conversation_manager.build_conversation_context(conversation['id'])
+                    conversation_context = conversation_manager.build_conversation_context(
+                        conversation['id'], conversation.get('total_messages')
+                    )
             except Exception as e:
                 print(f"⚠️ Context error: {e}")
                 conversation = conversation_manager.get_or_create_conversation(user_email, force_new=True)
@@ -1638,19 +2156,39 @@ def handle_universal_search():
         print(f"DEBUG: Query for summary detection: '{query}'")
         print(f"DEBUG: is_document_summary_query: {is_document_summary_query(query)}")
 
-        docs = conversation_documents.get(conversation['id'] if conversation else None, [])
-
-
-        doc_just_uploaded = (
-            conversation and
-            conversation['id'] in document_usage_tracker and
-            document_usage_tracker[conversation['id']]
-        )
+        # Wait briefly for an in-flight upload on this conversation, otherwise answer without RAG
+        ingest_pending = False
+        if conversation and ingest_queue.pending_for(conversation['id']):
+            print("⏳ Document upload still processing, waiting briefly...")
+            if not ingest_queue.wait_for_conversation(conversation['id'], INGEST_QUERY_WAIT_SECONDS):
+                ingest_pending = True
+                print("⏭️ Upload still processing, answering without document RAG")
+
+        # Chunks and the "just uploaded" flag are read together, so an upload finishing mid-request can't mix them
+        with conversation_locks(conversation['id'] if conversation else None).read():
+            docs = [] if ingest_pending else get_conversation_chunks(conversation['id'] if conversation else None)
+            doc_just_uploaded = (
+                conversation and
+                conversation['id'] in document_usage_tracker and
+                document_usage_tracker[conversation['id']]
+            )
 
-        if doc_just_uploaded and is_document_summary_query(query) and docs and len(docs) > 0:
+        # Claiming the flag (pop) is atomic, so two concurrent first queries can't both summarize
+        if (doc_just_uploaded and is_document_summary_query(query) and docs and len(docs) > 0
+                and document_usage_tracker.pop(conversation['id'])):
             print("📝 Detected document summary query and document is uploaded (first query after upload)!")
-            doc_text = " ".join([chunk['text'] for chunk in docs])
-            doc_text = doc_text[:4000]
+            # Summarize the document that was just uploaded, not everything in the conversation
+            latest_doc_id = docs[-1].get('doc_id')
+            # Only the first 4000 characters are used, so stop collecting once we have them (documents can be whole books)
+            doc_parts = []
+            doc_chars = 0
+            for chunk in docs:
+                if chunk.get('doc_id') == latest_doc_id:
+                    doc_parts.append(chunk['text'])
+                    doc_chars += len(chunk['text']) + 1
+                    if doc_chars >= 4000:
+                        break
+            doc_text = " ".join(doc_parts)[:4000]
             prompt = (
                 "Summarize the following document in 2-3 clear, well-structured paragraphs. "
                 "Focus on the main topics and key details. Separate each paragraph with a blank line.\n\n"
@@ -1664,13 +2202,11 @@ def handle_universal_search():
                 if not summary:
                     summary = "The document could not be summarized due to insufficient content."
             ai_response = summary
-            # Reset the flag so only the first query after upload triggers summary
-            document_usage_tracker[conversation['id']] = False
             if conversation_manager and conversation_manager.supabase and conversation:
                 try:
                     conversation_manager.save_message(
                         conversation['id'], 'assistant', ai_response, 'document_summary',
-                        None, None, ai_response
+                        None, None, ai_response, user_message=query
                     )
                 except Exception as e:
                     print(f"⚠️ Save error: {e}")
@@ -1714,7 +2250,7 @@ def handle_universal_search():
                     try:
                         conversation_manager.save_message(
                             conversation['id'], 'assistant', ai_response, 'website_summary',
-                            None, None, ai_response
+                            None, None, ai_response, user_message=query
                         )
                         print("✅ Saved website summary to conversation")
                     except Exception as e:
@@ -1725,17 +2261,18 @@ def handle_universal_search():
                 print("❌ Failed to fetch website content, falling back to regular search")
 
         # --- KEY CHANGE: Only use RAG if a document is uploaded for this conversation ---
-        docs = conversation_documents.get(conversation['id'] if conversation else None, [])
-        doc_allowed = False
-        if conversation and conversation['id'] in document_usage_tracker and document_usage_tracker[conversation['id']]:
-            doc_allowed = True
+        with conversation_locks(conversation['id'] if conversation else None).read():
+            docs = [] if ingest_pending else get_conversation_chunks(conversation['id'] if conversation else None)
+            doc_allowed = False
+            if conversation and conversation['id'] in document_usage_tracker and document_usage_tracker[conversation['id']]:
+                doc_allowed = True
         if not conversation:
             conversation = conversation_manager.get_or_create_conversation(user_email, force_new=True)
-        if docs and len(docs) > 0 and doc_allowed:
+        # Only the request that claims the flag uses the document
+        if docs and len(docs) > 0 and doc_allowed and document_usage_tracker.pop(conversation['id']):
             print("🔄 STEP 1: Document Analysis (RAG)...")
-            rag_context = search_documents(query, 3, conversation['id'] if conversation else None)
+            rag_context = search_documents(query, 3, conversation['id'] if conversation else None, nprobe, ef_search, hybrid)
             print(f"✅ STEP 1 Complete: RAG context length: {len(rag_context) if rag_context else 0}")
-            document_usage_tracker[conversation['id']] = False
             # If RAG context found, use it as the new query for web search
             if rag_context and "No relevant" not in rag_context and "Document search error" not in rag_context:
                 doc_based_query = rag_context.split('|')[0][:200]
@@ -1763,7 +2300,7 @@ def handle_universal_search():
                     query_type = 'rag_search' if used_rag else 'general'
                     conversation_manager.save_message(
                         conversation['id'], 'assistant', ai_response, query_type,
-                        web_results, rag_context, ai_response
+                        web_results, rag_context, ai_response, user_message=query
                     )
                     print("✅ Saved response to conversation")
                 except Exception as e:
@@ -1797,9 +2334,20 @@ def handle_universal_search():
             print(f"📤 Response data keys: {list(response_data.keys())}")
             return jsonify(response_data)
         else:
-            # No document uploaded: ONLY use Gemini AI for direct answer (web-like)
-            print("📄 No document uploaded for this conversation. Using Gemini AI web-only mode.")
-            ai_response = call_gemini_ai_web_only(query, conversation_context)
+            # No document uploaded: try the bundled knowledge base first, it saves a paid web search
+            knowledge_context, knowledge_score = search_knowledge(query)
+            ai_response = None
+            mode = 'web_search_only'
+            if knowledge_context and knowledge_score >= KNOWLEDGE_MIN_SCORE:
+                print(f"📚 Knowledge base covers this query (score {knowledge_score:.3f}), skipping web search.")
+                ai_response = call_gemini_ai_knowledge(query, knowledge_context, conversation_context)
+                if ai_response and len(ai_response.strip()) >= 10:
+                    mode = 'knowledge_base'
+
+            if mode == 'web_search_only':
+                # ONLY use Gemini AI for direct answer (web-like)
+                print("📄 No document uploaded for this conversation. Using Gemini AI web-only mode.")
+                ai_response = call_gemini_ai_web_only(query, conversation_context)
             if not ai_response or len(ai_response.strip()) < 10:
                 ai_response = f"Based on the current information about {query}, here's a comprehensive overview: " + \
                              f"The analysis shows multiple factors are relevant to understanding {query}. " + \
@@ -1808,8 +2356,9 @@ def handle_universal_search():
             if conversation_manager and conversation_manager.supabase and conversation:
                 try:
                     conversation_manager.save_message(
-                        conversation['id'], 'assistant', ai_response, 'web_search_only',
-                        None, None, ai_response
+                        conversation['id'], 'assistant', ai_response, mode,
+                        None, knowledge_context if mode == 'knowledge_base' else None, ai_response,
+                        user_message=query
                     )
                 except Exception as e:
                     print(f"⚠️ Save error: {e}")
@@ -1821,9 +2370,9 @@ def handle_universal_search():
                 'rag_context': None,
                 'conversation_context': conversation_context,
                 'conversation_id': conversation['id'] if conversation else None,
-                'mode': 'web_search_only',
+                'mode': mode,
                 'steps_completed': {
-                    'step1_web_search': True,
+                    'step1_web_search': mode == 'web_search_only',
                     'step2_document_analysis': False,
                     'step3_ai_generation': len(ai_response) > 10
                 },
@@ -1833,7 +2382,10 @@ def handle_universal_search():
                     'rag_context_length': 0,
                     'response_length': len(ai_response),
                     'conversation_context_available': len(conversation_context) > 0,
-                    'conversation_id': conversation['id'] if conversation else None
+                    'conversation_id': conversation['id'] if conversation else None,
+                    'document_upload_pending': ingest_pending,
+                    'knowledge_score': round(knowledge_score, 3),
+                    'knowledge_index_version': knowledge_index.version if knowledge_index else None
                 },
                 'timestamp': datetime.now().isoformat()
             }
@@ -1875,6 +2427,14 @@ def get_conversation_messages(conversation_id):
         if not conversation_manager or not conversation_manager.supabase:
             return jsonify({'messages': []})
 
+        # Optional paging: {"limit": N, "before": <next_cursor>} walks back from the newest messages
+        data = request.get_json(silent=True) or {}
+        if data.get('limit') or data.get('before') is not None:
+            messages, next_cursor = conversation_manager.get_conversation_messages_page(
+                conversation_id, data.get('limit') or MESSAGES_PAGE_SIZE, data.get('before')
+            )
+            return jsonify({'messages': messages, 'next_cursor': next_cursor})
+
         messages = conversation_manager.get_conversation_messages(conversation_id)
         return jsonify({'messages': messages})
 
@@ -1906,6 +2466,10 @@ def delete_conversation(conversation_id):
             return jsonify({'error': 'Service unavailable'}), 503
 
         success = conversation_manager.archive_conversation(conversation_id)
+        if success:
+            with conversation_locks(conversation_id).write():
+                conversation_rag_cache.evict(conversation_id)
+                document_usage_tracker.pop(conversation_id, None)
         return jsonify({'success': success})
 
     except Exception as e:
@@ -1947,12 +2511,87 @@ def after_request(response):
     
     return response
 
+def conversation_access_error(conversation_id):
+    """
+    None if the caller (user_email in the JSON body or query string) owns conversation_id,
+    else the error response. Unknown, invalid and other users' ids all get the same 404.
+    """
+    if not conversation_manager or not conversation_manager.supabase:
+        return jsonify({'error': 'Service unavailable'}), 503
+
+    data = request.get_json(silent=True) or {}
+    user_email = data.get('user_email') or request.args.get('user_email')
+    if not user_email:
+        return jsonify({'error': 'Missing user_email'}), 400
+
+    if not valid_conversation_id(conversation_id) or \
+            not conversation_manager.conversation_belongs_to(conversation_id, user_email):
+        return jsonify({'error': 'Conversation not found'}), 404
+    return None
+
+@app.route('/api/conversation/<conversation_id>/documents', methods=['GET'])
+def list_conversation_documents(conversation_id):
+    error = conversation_access_error(conversation_id)
+    if error:
+        return error
+
+    state = load_conversation_rag(conversation_id)
+    documents = state.document_ids() if state else {}
+    return jsonify({'documents': [
+        {'doc_id': doc_id, 'filename': info['filename'], 'chunks': info['chunks']}
+        for doc_id, info in documents.items()
+    ]})
+
+@app.route('/api/conversation/<conversation_id>/documents/<doc_id>', methods=['DELETE'])
+def delete_conversation_document(conversation_id, doc_id):
+    try:
+        error = conversation_access_error(conversation_id)
+        if error:
+            return error
+
+        state = load_conversation_rag(conversation_id)
+        documents = state.document_ids() if state else {}
+        if doc_id not in documents:
+            return jsonify({'success': False, 'message': f"Document {doc_id} not found"}), 404
+
+        # Flat indexes compact in place; HNSW / IVF-PQ are rebuilt, which can take minutes, so on the ingest pool
+        if state.index is not None and index_tier(state.index) != TIER_FLAT:
+            job = IngestJob(conversation_id, documents[doc_id]['filename'], doc_id=doc_id)
+            try:
+                ingest_queue.submit(job, run_document_removal)
+            except IngestQueueFull as e:
+                return jsonify({'success': False, 'error': str(e)}), 503
+            return jsonify({
+                'success': True,
+                'status': 'processing',
+                'message': f"Removing {documents[doc_id]['filename']} in the background.",
+                'job_id': job.job_id,
+                'progress_url': f'/upload/{job.job_id}'
+            }), 202
+
+        success, message = remove_document_from_rag(conversation_id, doc_id)
+        return jsonify({'success': success, 'message': message}), (200 if success else 404)
+    except Exception as e:
+        print(f"❌ Error removing document: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/rag/cache-stats', methods=['GET'])
+def rag_cache_stats():
+    return jsonify({
+        'conversation_cache': conversation_rag_cache.stats(),
+        'embedding_cache': embedding_cache.stats() if embedding_cache else None,
+        'query_cache': query_encoder.stats() if query_encoder else None,
+        'message_journal': conversation_manager.journal.stats() if conversation_manager and conversation_manager.journal else None,
+        'recent_messages': conversation_manager.recent.stats() if conversation_manager else None,
+        'user_cache': conversation_manager.user_cache.stats() if conversation_manager else None
+    })
+
 @app.route('/')
 def index():
     return jsonify({
         'status': 'online',
         'message': 'AI Agent Backend is running!',
-        'endpoints': ['/api/news', '/upload', '/api/conversations', '/health'],
+        'endpoints': ['/api/news', '/api/news/stream', '/upload', '/api/conversations', '/health', '/health/ready'],
         'features': ['web_search', 'rag_documents', 'website_content_fetching', 'conversation_history']
     })
 
@@ -1964,7 +2603,15 @@ def health():
 """
 @app.route('/health')
 def health():
-    return jsonify({"status": "OK"}), 200
+    """Liveness: always 200 while the process is serving; readiness is reported alongside"""
+    return jsonify({"status": "OK", "live": True, "ready": rag_ready.is_set(), "rag": rag_status()}), 200
+
+@app.route('/health/ready')
+def health_ready():
+    """Readiness probe: 503 until the embedding model has finished loading (or failed to)"""
+    if not rag_ready.is_set():
+        return jsonify({"status": "starting", "rag": rag_status()}), 503
+    return jsonify({"status": "ready", "rag": rag_status()}), 200
 # ...existing code...
 
 # URL detection and website content fetching functions
@@ -2020,6 +2667,7 @@ def fetch_website_content(url):
 
     # Try newspaper3k first
     try:
+        from newspaper import Article
         article = Article(url)
         article.download()
         article.parse()
@@ -2042,6 +2690,9 @@ def fetch_website_content(url):
 
     # Fallback: Selenium + BeautifulSoup (your existing code)
     try:
+        from bs4 import BeautifulSoup
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
         chrome_options = Options()
         chrome_options.add_argument("--headless")
         chrome_options.add_argument("--disable-gpu")
@@ -0,0 +1,224 @@
+"""
+Write-behind journal for conversation messages.
+save_message() appends the exchange to a local SQLite (WAL) journal and returns right away;
+a background thread flushes the journal to Supabase in batches, one write per conversation,
+retrying failures with exponential backoff. Entries are deleted only after Supabase has
+accepted them, so a crash or a Supabase outage loses nothing. A flush can be repeated (lost
+response, stale claim); each message's client_id lets append_messages skip what it already stored.
+The journal file is shared by every worker process of an instance (it lives on local disk,
+LOCAL_STATE_DIR, never on a shared volume): a flusher claims the rows it writes,
+and a conversation is only ever flushed by one flusher at a time, in journal order.
+History reads merge the entries that haven't reached Supabase yet (pending()).
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from rag_store import LOCAL_STATE_DIR
+
+MESSAGE_WRITE_BEHIND = os.getenv('MESSAGE_WRITE_BEHIND', 'true').lower() == 'true'
+MESSAGE_JOURNAL_PATH = os.getenv('MESSAGE_JOURNAL_PATH', os.path.join(LOCAL_STATE_DIR, 'message_journal.sqlite3'))
+MESSAGE_JOURNAL_BATCH = int(os.getenv('MESSAGE_JOURNAL_BATCH', '50'))
+# Backpressure: past this many unflushed exchanges, save_message waits for the flusher to catch up
+MESSAGE_JOURNAL_MAX_PENDING = int(os.getenv('MESSAGE_JOURNAL_MAX_PENDING', '1000'))
+MESSAGE_JOURNAL_BLOCK_SECONDS = float(os.getenv('MESSAGE_JOURNAL_BLOCK_SECONDS', '5'))
+# After this many failed flushes an entry is parked (kept on disk, no longer retried)
+MESSAGE_JOURNAL_MAX_ATTEMPTS = int(os.getenv('MESSAGE_JOURNAL_MAX_ATTEMPTS', '20'))
+
+_FLUSH_INTERVAL = 0.5
+_RETRY_BASE_SECONDS = 1.0
+_RETRY_MAX_SECONDS = 300.0
+# A claim older than this belongs to a flusher that died mid-write
+_CLAIM_STALE_SECONDS = 120.0
+
+
+class MessageJournal:
+    def __init__(self, sink, path=MESSAGE_JOURNAL_PATH, batch_size=MESSAGE_JOURNAL_BATCH,
+                 max_pending=MESSAGE_JOURNAL_MAX_PENDING, block_seconds=MESSAGE_JOURNAL_BLOCK_SECONDS,
+                 max_attempts=MESSAGE_JOURNAL_MAX_ATTEMPTS):
+        # sink(conversation_id, messages) writes to Supabase and raises on failure
+        self.sink = sink
+        self.path = path
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.block_seconds = block_seconds
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._conn_pid = None
+        self._conn = self._connect()
+        # The flusher is started on first use, so a preloading master never forks with it running
+        self._worker = None
+        self._worker_pid = None
+
+        self.flushed = 0
+        self.failures = 0
+
+    def _connect(self):
+        # Autocommit; the claim step opens its own BEGIN IMMEDIATE transaction
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS pending ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " conversation_id TEXT NOT NULL,"
+            " messages TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt_at REAL NOT NULL DEFAULT 0,"
+            " last_error TEXT,"
+            " claimed_by INTEGER,"
+            " claimed_at REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS pending_conversation ON pending (conversation_id, id)")
+        self._conn_pid = os.getpid()
+        return conn
+
+    @property
+    def conn(self):
+        """This process's connection; a SQLite connection must not be used across fork()"""
+        if self._conn_pid != os.getpid():
+            self._conn = self._connect()
+        return self._conn
+
+    def _ensure_worker(self):
+        if self._worker_pid == os.getpid() and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker_pid != os.getpid() or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='message-journal', daemon=True)
+                self._worker.start()
+                self._worker_pid = os.getpid()
+
+    def pending_count(self):
+        with self._lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM pending WHERE attempts < ?", (self.max_attempts,)
+            ).fetchone()[0]
+
+    def append(self, conversation_id, messages):
+        """Journal one exchange (a list of message_row dicts) for conversation_id"""
+        self._ensure_worker()
+        deadline = time.monotonic() + self.block_seconds
+        while self.pending_count() >= self.max_pending and time.monotonic() < deadline:
+            self._wake.set()
+            time.sleep(0.05)
+
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO pending (conversation_id, messages, created_at) VALUES (?, ?, ?)",
+                (str(conversation_id), json.dumps(messages, default=str), time.time())
+            )
+        self._wake.set()
+
+    def pending(self, conversation_id):
+        """
+        Messages of conversation_id not yet confirmed by Supabase, oldest first. Each gets an id
+        (its client_id, or one derived from the journal row) and created_at, the time it was journaled.
+        """
+        self._ensure_worker()
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT id, created_at, messages FROM pending WHERE conversation_id = ? AND attempts < ? ORDER BY id",
+                (str(conversation_id), self.max_attempts)
+            ).fetchall()
+
+        messages = []
+        for entry_id, created_at, payload in rows:
+            stamp = datetime.fromtimestamp(created_at, timezone.utc).isoformat()
+            for i, message in enumerate(json.loads(payload)):
+                messages.append(dict(message, id=message.get('client_id') or f"pending-{entry_id}-{i}",
+                                     created_at=stamp))
+        return messages
+
+    def _claim(self):
+        now = time.time()
+        stale = now - _CLAIM_STALE_SECONDS
+        with self._lock:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Skip conversations another flusher holds or that are backing off, so each
+                # conversation's entries go out in order
+                rows = conn.execute(
+                    "SELECT id, conversation_id, messages, attempts FROM pending"
+                    " WHERE attempts < ? AND (claimed_by IS NULL OR claimed_at < ?)"
+                    " AND conversation_id NOT IN ("
+                    "  SELECT conversation_id FROM pending WHERE attempts < ?"
+                    "  AND (next_attempt_at > ? OR (claimed_by IS NOT NULL AND claimed_at >= ?)))"
+                    " ORDER BY id LIMIT ?",
+                    (self.max_attempts, stale, self.max_attempts, now, stale, self.batch_size)
+                ).fetchall()
+                conn.executemany(
+                    "UPDATE pending SET claimed_by = ?, claimed_at = ? WHERE id = ?",
+                    [(os.getpid(), now, row[0]) for row in rows]
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return rows
+
+    def flush_once(self):
+        """Flush one batch; returns how many journal entries were attempted"""
+        rows = self._claim()
+        by_conversation = {}
+        for row in rows:
+            by_conversation.setdefault(row[1], []).append(row)
+
+        for conversation_id, entries in by_conversation.items():
+            ids = [entry[0] for entry in entries]
+            messages = [message for entry in entries for message in json.loads(entry[2])]
+            try:
+                self.sink(conversation_id, messages)
+            except Exception as e:
+                attempts = max(entry[3] for entry in entries) + 1
+                delay = min(_RETRY_MAX_SECONDS, _RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+                self.failures += 1
+                if attempts >= self.max_attempts:
+                    print(f"❌ Giving up on {len(messages)} journaled messages for conversation "
+                          f"{conversation_id} after {attempts} attempts: {e}")
+                else:
+                    print(f"⚠️ Message flush failed for conversation {conversation_id} "
+                          f"(attempt {attempts}, retrying in {delay:.0f}s): {e}")
+                with self._lock:
+                    self.conn.executemany(
+                        "UPDATE pending SET attempts = ?, next_attempt_at = ?, last_error = ?,"
+                        " claimed_by = NULL, claimed_at = NULL WHERE id = ?",
+                        [(attempts, time.time() + delay, str(e)[:500], entry_id) for entry_id in ids]
+                    )
+                continue
+
+            with self._lock:
+                self.conn.executemany("DELETE FROM pending WHERE id = ?", [(entry_id,) for entry_id in ids])
+            self.flushed += len(messages)
+        return len(rows)
+
+    def _run(self):
+        while True:
+            self._wake.wait(_FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                while self.flush_once():
+                    pass
+            except Exception as e:
+                print(f"❌ Message journal flush error: {e}")
+                time.sleep(_FLUSH_INTERVAL)
+
+    def stats(self):
+        with self._lock:
+            pending, parked = self.conn.execute(
+                "SELECT COALESCE(SUM(attempts < ?), 0), COALESCE(SUM(attempts >= ?), 0) FROM pending",
+                (self.max_attempts, self.max_attempts)
+            ).fetchone()
+        return {
+            'path': self.path,
+            'pending': pending,
+            'parked': parked,
+            'flushed': self.flushed,
+            'failures': self.failures
+        }
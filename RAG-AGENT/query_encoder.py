@@ -0,0 +1,143 @@
+"""
+Query embedding with an in-memory LRU cache and micro-batching.
+Repeated queries ("summarize", "what are the key points") are served from the cache;
+concurrent misses are gathered for up to QUERY_BATCH_WINDOW_MS and encoded in one
+forward pass instead of N batches of one.
+"""
+import os
+import time
+import queue
+import threading
+from collections import OrderedDict
+import numpy as np
+import faiss
+
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', '2048'))
+QUERY_BATCH_WINDOW_MS = float(os.getenv('QUERY_BATCH_WINDOW_MS', '5'))
+QUERY_BATCH_MAX = int(os.getenv('QUERY_BATCH_MAX', '32'))
+
+
+class _PendingQuery:
+    __slots__ = ('text', 'done', 'vector', 'error')
+
+    def __init__(self, text):
+        self.text = text
+        self.done = threading.Event()
+        self.vector = None
+        self.error = None
+
+
+class QueryEncoder:
+    def __init__(self, model, cache_size=QUERY_CACHE_SIZE, batch_window_ms=QUERY_BATCH_WINDOW_MS,
+                 max_batch=QUERY_BATCH_MAX):
+        self.model = model
+        self.cache_size = cache_size
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_pid = None
+
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+        self.batched_queries = 0
+
+    def encode(self, query):
+        """Normalized (1, d) float32 embedding of query"""
+        key = " ".join(query.split())
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return vector.copy()
+            self.misses += 1
+
+        if self.batch_window > 0 and self.max_batch > 1:
+            vector = self._encode_batched(key)
+        else:
+            vector = self._encode_now([key])[0]
+
+        with self._lock:
+            self._cache[key] = vector
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return vector.copy()
+
+    def _encode_now(self, texts):
+        vectors = np.asarray(self.model.encode(texts, show_progress_bar=False), dtype=np.float32)
+        faiss.normalize_L2(vectors)
+        return [vectors[i:i + 1] for i in range(len(texts))]
+
+    def _encode_batched(self, text):
+        self._ensure_worker()
+        pending = _PendingQuery(text)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.vector
+
+    def _ensure_worker(self):
+        # Threads don't survive fork, so a forked worker process starts its own batcher
+        with self._lock:
+            if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+                return
+            self._queue = queue.Queue()
+            self._worker = threading.Thread(target=self._run, args=(self._queue,), name='query-encoder', daemon=True)
+            self._worker_pid = os.getpid()
+            self._worker.start()
+
+    def _run(self, requests):
+        while True:
+            batch = [requests.get()]
+            # Gather whatever else arrives within the window after the first request
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # Identical concurrent queries are encoded once
+            texts = list(dict.fromkeys(p.text for p in batch))
+            try:
+                vectors = dict(zip(texts, self._encode_now(texts)))
+                for p in batch:
+                    p.vector = vectors[p.text]
+            except Exception as e:
+                for p in batch:
+                    p.error = e
+            finally:
+                for p in batch:
+                    p.done.set()
+
+            with self._lock:
+                self.batches += 1
+                self.batched_queries += len(batch)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._cache),
+                'max_entries': self.cache_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'batches': self.batches,
+                'avg_batch_size': round(self.batched_queries / self.batches, 2) if self.batches else 0.0,
+                'batch_window_ms': self.batch_window * 1000
+            }
@@ -0,0 +1,497 @@
+"""
+On-disk store for per-conversation document RAG state.
+Each conversation gets its own directory holding the FAISS index and the chunk
+list, so uploaded documents survive restarts and redeploys. Indexes are loaded
+lazily, so idle conversations cost no RAM, and memory-mapped (IO_FLAG_MMAP_IFC), so
+loaded ones are paged in from the file rather than copied. The index is the only
+copy of the vectors, on disk and in memory.
+"""
+import os
+import re
+import json
+import shutil
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+import faiss
+from lexical_index import BM25Index
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+RAG_INDEX_DIR = os.getenv(
+    'RAG_INDEX_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rag_indexes')
+)
+# Per-instance SQLite files (embedding cache, message journal). Keep this on local disk even when
+# RAG_INDEX_DIR is a shared volume: SQLite WAL doesn't work over network filesystems
+LOCAL_STATE_DIR = os.getenv(
+    'LOCAL_STATE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'local_state')
+)
+
+
+# Conversation ids come from the client and name directories: only plain names, never '.', '..'
+# or other dot-names (which would also collide with the store's own .locks directory)
+_CONVERSATION_ID_RE = re.compile(r'^[A-Za-z0-9_-][A-Za-z0-9_.-]{0,127}$')
+
+
+def valid_conversation_id(conversation_id):
+    return conversation_id is not None and bool(_CONVERSATION_ID_RE.match(str(conversation_id)))
+
+
+# IO_FLAG_MMAP only maps IVF inverted lists (a flat index is still read into RAM);
+# IO_FLAG_MMAP_IFC (faiss >= 1.11) maps the codes of every index type
+_MMAP_FLAG = getattr(faiss, 'IO_FLAG_MMAP_IFC', None)
+
+
+def read_index_mmap(path):
+    """Read a FAISS index memory-mapped where this faiss supports it; returns (index, mmapped)"""
+    if _MMAP_FLAG is not None:
+        try:
+            return faiss.read_index(path, _MMAP_FLAG), True
+        except RuntimeError:
+            pass  # Index types without mmap support are read normally
+    return faiss.read_index(path), False
+
+
+def _lock_file(lock_file):
+    if fcntl:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return
+    # msvcrt locks a byte range from the current position; LK_LOCK gives up after ~10 s, so retry
+    lock_file.seek(0)
+    while True:
+        try:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            continue
+
+
+def _unlock_file(lock_file):
+    if fcntl:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return
+    lock_file.seek(0)
+    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class DiskIndexStore:
+    INDEX_FILE = 'index.faiss'
+    CHUNKS_FILE = 'chunks.json'
+
+    # Conversations get their own subdirectory, so no conversation id can name the lock
+    # directory or anything else kept under root (e.g. ingest job status in root/jobs)
+    CONVERSATIONS_DIR = 'conversations'
+    LOCK_DIR = '.locks'
+
+    def __init__(self, root=RAG_INDEX_DIR):
+        self.root = root
+        self.conversations_root = os.path.join(root, self.CONVERSATIONS_DIR)
+        os.makedirs(os.path.join(self.root, self.LOCK_DIR), exist_ok=True)
+        os.makedirs(self.conversations_root, exist_ok=True)
+        self._migrate_flat_layout()
+
+    def _migrate_flat_layout(self):
+        """Move conversation directories saved directly under root (older layout) into conversations/"""
+        for name in os.listdir(self.root):
+            legacy_dir = os.path.join(self.root, name)
+            if (name == self.CONVERSATIONS_DIR or not valid_conversation_id(name)
+                    or not os.path.exists(os.path.join(legacy_dir, self.CHUNKS_FILE))):
+                continue
+            try:
+                os.rename(legacy_dir, os.path.join(self.conversations_root, name))
+                print(f"📦 Moved RAG index for conversation {name} to {self.conversations_root}")
+            except OSError:
+                pass  # Another worker moved it first, or a newer copy already exists
+
+    def _safe_id(self, conversation_id):
+        if not valid_conversation_id(conversation_id):
+            raise ValueError(f"Invalid conversation id: {conversation_id!r}")
+        return str(conversation_id)
+
+    def _conversation_dir(self, conversation_id):
+        return os.path.join(self.conversations_root, self._safe_id(conversation_id))
+
+    def _checked_dir(self, conversation_id):
+        """_conversation_dir(), verified to resolve inside conversations/; used before anything is written or removed"""
+        path = self._conversation_dir(conversation_id)
+        if not os.path.realpath(path).startswith(os.path.realpath(self.conversations_root) + os.sep):
+            raise ValueError(f"Conversation directory escapes {self.conversations_root}: {conversation_id!r}")
+        return path
+
+    def exists(self, conversation_id):
+        return valid_conversation_id(conversation_id) and os.path.exists(os.path.join(self._conversation_dir(conversation_id), self.CHUNKS_FILE))
+
+    def version(self, conversation_id):
+        """
+        Identity of the stored copy, or None if there is none. Every save renames a new
+        chunk list into place, so the inode changes and other worker processes can tell
+        their cached state is stale with one stat() call.
+        """
+        if not valid_conversation_id(conversation_id):
+            return None
+        try:
+            st = os.stat(os.path.join(self._conversation_dir(conversation_id), self.CHUNKS_FILE))
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns)
+
+    @contextmanager
+    def write_lock(self, conversation_id):
+        """
+        Exclusive cross-process lock for a conversation's read-modify-write cycle (append or
+        remove a document), so two workers never save over each other's changes. Readers
+        don't take it. Lock files live outside the conversation directory so delete() can't
+        pull one out from under a holder.
+        """
+        lock_path = os.path.join(self.root, self.LOCK_DIR, self._safe_id(conversation_id) + '.lock')
+        with open(lock_path, 'a+') as lock_file:
+            _lock_file(lock_file)
+            try:
+                yield
+            finally:
+                _unlock_file(lock_file)
+
+    def flags(self, name):
+        """Per-conversation boolean flag stored as a marker file, visible to every worker process"""
+        return DiskFlags(self, name)
+
+    def save(self, conversation_id, chunks, index):
+        """Write index and chunks once at upload time; returns the new version()"""
+        conv_dir = self._checked_dir(conversation_id)
+        os.makedirs(conv_dir, exist_ok=True)
+
+        # Write to temp names and rename, so a crash never leaves a torn index.
+        # The chunk list goes last because exists() keys off it.
+        index_path = os.path.join(conv_dir, self.INDEX_FILE)
+        faiss.write_index(index, index_path + '.tmp')
+        os.replace(index_path + '.tmp', index_path)
+
+        chunks_path = os.path.join(conv_dir, self.CHUNKS_FILE)
+        with open(chunks_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(chunks, f, ensure_ascii=False)
+        os.replace(chunks_path + '.tmp', chunks_path)
+
+        print(f"💾 Saved RAG index for conversation {conversation_id} ({len(chunks)} chunks)")
+        return self.version(conversation_id)
+
+    def load(self, conversation_id):
+        """Return (chunks, index, version, mmapped) from disk, or None if nothing is stored"""
+        if not valid_conversation_id(conversation_id):
+            return None
+        conv_dir = self._conversation_dir(conversation_id)
+        try:
+            # Another worker may be mid-save (index written, chunk list not yet); retry until they match
+            for attempt in range(5):
+                version = self.version(conversation_id)
+                if version is None:
+                    return None
+                with open(os.path.join(conv_dir, self.CHUNKS_FILE), 'r', encoding='utf-8') as f:
+                    chunks = json.load(f)
+
+                index, mmapped = read_index_mmap(os.path.join(conv_dir, self.INDEX_FILE))
+                if index.ntotal == len(chunks) and self.version(conversation_id) == version:
+                    break
+                time.sleep(0.05 * (attempt + 1))
+            else:
+                raise RuntimeError("index and chunk list kept changing while loading")
+
+            print(f"📂 Loaded RAG index for conversation {conversation_id} from disk ({len(chunks)} chunks)")
+            return chunks, index, version, mmapped
+        except Exception as e:
+            print(f"❌ Failed to load RAG index for conversation {conversation_id}: {e}")
+            return None
+
+    def delete(self, conversation_id):
+        shutil.rmtree(self._checked_dir(conversation_id), ignore_errors=True)
+
+
+class DiskFlags:
+    """
+    Dict-like {conversation_id: bool} backed by marker files in each conversation's
+    directory; a missing marker reads as False.
+    """
+
+    def __init__(self, store, name):
+        self.store = store
+        self.name = '.' + name
+
+    def _path(self, conversation_id):
+        return os.path.join(self.store._conversation_dir(conversation_id), self.name)
+
+    def __contains__(self, conversation_id):
+        return valid_conversation_id(conversation_id) and os.path.exists(self._path(conversation_id))
+
+    def __getitem__(self, conversation_id):
+        return conversation_id in self
+
+    def __setitem__(self, conversation_id, value):
+        if value:
+            os.makedirs(self.store._checked_dir(conversation_id), exist_ok=True)
+            open(self._path(conversation_id), 'a').close()
+        else:
+            self.pop(conversation_id, None)
+
+    def pop(self, conversation_id, default=None):
+        if not valid_conversation_id(conversation_id):
+            return default
+        try:
+            os.remove(self._path(conversation_id))
+            return True
+        except FileNotFoundError:
+            return default
+
+
+RAG_CACHE_MAX_BYTES = int(os.getenv('RAG_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+RAG_CACHE_TTL_SECONDS = int(os.getenv('RAG_CACHE_TTL_SECONDS', '3600'))
+
+
+class ConversationRAGState:
+    """Chunks and FAISS index of one conversation's uploaded documents"""
+
+    def __init__(self, chunks, index=None, mmapped=False, lexical=None, disk_version=None):
+        self.chunks = chunks
+        self.index = index  # The only copy of the vectors; use vectors() to read them
+        self.mmapped = mmapped
+        self.lexical = lexical  # BM25 over the chunk texts, built on first hybrid search
+        self.disk_version = disk_version  # DiskIndexStore.version() this state matches
+        # Chunks and vectors are fixed for the life of the state; only the BM25 postings grow
+        self._fixed_nbytes = self._estimate_fixed_nbytes()
+        self.refresh_nbytes()
+
+    def _estimate_fixed_nbytes(self):
+        size = sum(len(c.get('text', '')) + len(c.get('filename', '')) for c in self.chunks)
+        if self.index is not None:
+            size += self.index.ntotal * self.index.d * 4
+        return size
+
+    def refresh_nbytes(self):
+        """Recompute nbytes after the state grew in place; the cache picks it up via resize()/put()"""
+        self.nbytes = self._fixed_nbytes + (self.lexical.nbytes() if self.lexical is not None else 0)
+
+    def writable_index(self):
+        """
+        Private in-RAM copy of the index to add to or remove from. The published index is
+        never mutated, since queries may be searching it; the new (chunks, index) pair
+        replaces this state in one swap once it is complete.
+        """
+        if self.index is None:
+            return None
+        if self.mmapped:
+            # A clone of a mapped index still views the file, and growing a viewed index aborts
+            # the process; a serialize round trip gives an owned copy
+            return faiss.deserialize_index(faiss.serialize_index(self.index))
+        return faiss.clone_index(self.index)
+
+    def document_ids(self):
+        """Ordered {doc_id: {'filename', 'chunks'}} for the documents in this conversation"""
+        documents = OrderedDict()
+        for chunk in self.chunks:
+            doc = documents.setdefault(chunk.get('doc_id'), {'filename': chunk.get('filename'), 'chunks': 0})
+            doc['chunks'] += 1
+        return documents
+
+    def lexical_index(self):
+        """BM25 index aligned with the chunk list; rebuilt from the chunk texts rather than stored on disk"""
+        if self.lexical is None or len(self.lexical) < len(self.chunks):
+            self.lexical = BM25Index(chunk.get('text', '') for chunk in self.chunks)
+            self.refresh_nbytes()
+        return self.lexical
+
+    def vectors(self):
+        """Return the normalized chunk vectors as an (ntotal, d) float32 array"""
+        return index_vectors(self.index)
+
+
+def index_vectors(index):
+    """
+    Read the stored vectors out of a FAISS index. Flat indexes return a zero-copy
+    view of the index's own buffer (valid only while the index is alive and
+    unmodified), as do IVF-PQ indexes with a flat refine stage; other index types
+    fall back to reconstruct_n, which copies (and is lossy for plain IVF-PQ).
+    """
+    if index is None or index.ntotal == 0:
+        return np.zeros((0, index.d if index is not None else 0), dtype=np.float32)
+
+    if isinstance(index, faiss.IndexFlat):
+        buffer = faiss.rev_swig_ptr(index.get_xb(), index.ntotal * index.d)
+        return buffer.reshape(index.ntotal, index.d)
+    if isinstance(index, faiss.IndexRefine):
+        # The refine stage holds the exact vectors (IVF-PQ built with RFlat)
+        return index_vectors(faiss.downcast_index(index.refine_index))
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+class ReadWriteLock:
+    """Many readers or one writer. A waiting writer holds off new readers so swaps aren't starved."""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class ConversationLocks:
+    """
+    One ReadWriteLock per conversation, so an upload only ever holds off queries on its own
+    conversation. Locks nobody holds are dropped automatically. Not reentrant: take a
+    conversation's read lock once per operation, never nested.
+    """
+
+    def __init__(self):
+        self._locks = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def __call__(self, conversation_id):
+        with self._lock:
+            lock = self._locks.get(conversation_id)
+            if lock is None:
+                lock = ReadWriteLock()
+                self._locks[conversation_id] = lock
+            return lock
+
+
+class ConversationRAGCache:
+    """
+    Bounded LRU cache of ConversationRAGState keyed by conversation id.
+    Entries are evicted when the byte budget is exceeded or when they sit idle
+    longer than the TTL. Evicted conversations reload from DiskIndexStore.
+    """
+
+    def __init__(self, max_bytes=RAG_CACHE_MAX_BYTES, ttl_seconds=RAG_CACHE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # {conversation_id: (state, last_access, bytes charged)}
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, conversation_id):
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            state, last_access, charged = entry
+            now = time.monotonic()
+            if self.ttl_seconds and now - last_access > self.ttl_seconds:
+                self._remove(conversation_id)
+                self.evictions += 1
+                self.misses += 1
+                return None
+
+            self._entries[conversation_id] = (state, now, charged)
+            self._entries.move_to_end(conversation_id)
+            self.hits += 1
+            return state
+
+    def put(self, conversation_id, state):
+        with self._lock:
+            if conversation_id in self._entries:
+                self._remove(conversation_id)
+            self._entries[conversation_id] = (state, time.monotonic(), state.nbytes)
+            self.current_bytes += state.nbytes
+            self._enforce_limits(keep=conversation_id)
+
+    def resize(self, conversation_id, state):
+        """Re-account a cached state whose nbytes changed, e.g. once its BM25 index is built"""
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None or entry[0] is not state or entry[2] == state.nbytes:
+                return
+            self._entries[conversation_id] = (state, entry[1], state.nbytes)
+            self.current_bytes += state.nbytes - entry[2]
+            self._enforce_limits(keep=conversation_id)
+
+    def evict(self, conversation_id):
+        with self._lock:
+            if conversation_id in self._entries:
+                self._remove(conversation_id)
+                self.evictions += 1
+                return True
+            return False
+
+    def _remove(self, conversation_id):
+        # What was charged, not state.nbytes: a state can grow after it was cached
+        _, _, charged = self._entries.pop(conversation_id)
+        self.current_bytes -= charged
+
+    def _enforce_limits(self, keep=None):
+        now = time.monotonic()
+        if self.ttl_seconds:
+            expired = [cid for cid, (_, last_access, _) in self._entries.items()
+                       if now - last_access > self.ttl_seconds and cid != keep]
+            for cid in expired:
+                self._remove(cid)
+                self.evictions += 1
+
+        # Oldest first; the entry just inserted sits at the end and is never evicted
+        while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+            cid = next(iter(self._entries))
+            self._remove(cid)
+            self.evictions += 1
+            print(f"🧹 Evicted RAG state for conversation {cid} (cache over budget)")
+
+    def __contains__(self, conversation_id):
+        with self._lock:
+            return conversation_id in self._entries
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'conversations': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+            }
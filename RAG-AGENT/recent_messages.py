@@ -0,0 +1,74 @@
+"""
+In-memory ring buffers of each conversation's most recent messages, used to build the
+conversation context without a Supabase read per query.
+A buffer is filled from Supabase once (on a miss) and then extended by every save, so it
+always holds the last `window` messages. Each entry remembers the conversation's
+total_messages it has accounted for; a larger count on the conversation row means another
+worker process wrote to the conversation, and the buffer is reloaded. Messages other workers
+have journaled but not yet flushed don't move that count, so readers merge the journal too.
+"""
+import os
+import threading
+from collections import OrderedDict, deque
+
+RECENT_MESSAGES_CONVERSATIONS = int(os.getenv('RECENT_MESSAGES_CONVERSATIONS', '1000'))
+# Only what the context builder reads is kept, plus client_id to line entries up with the message journal
+_FIELDS = ('role', 'content', 'ai_response', 'client_id')
+
+
+class RecentMessages:
+    def __init__(self, window=14, max_conversations=RECENT_MESSAGES_CONVERSATIONS):
+        self.window = window
+        self.max_conversations = max_conversations
+        self._entries = OrderedDict()  # {conversation_id: [deque of messages, total_messages]}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _trim(self, message):
+        return {field: message.get(field) for field in _FIELDS}
+
+    def get(self, conversation_id, total_messages=None):
+        """The buffered messages, oldest first, or None if they must be (re)loaded"""
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None or (total_messages is not None and
+                                 (entry[1] is None or total_messages > entry[1])):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(conversation_id)
+            self.hits += 1
+            return list(entry[0])
+
+    def fill(self, conversation_id, messages, total_messages=None):
+        with self._lock:
+            self._entries[conversation_id] = [
+                deque((self._trim(m) for m in messages), maxlen=self.window), total_messages
+            ]
+            self._entries.move_to_end(conversation_id)
+            while len(self._entries) > self.max_conversations:
+                self._entries.popitem(last=False)
+
+    def extend(self, conversation_id, messages):
+        """Append newly saved messages; conversations that aren't buffered are left to load on demand"""
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                return
+            entry[0].extend(self._trim(m) for m in messages)
+            if entry[1] is not None:
+                entry[1] += len(messages)
+
+    def evict(self, conversation_id):
+        with self._lock:
+            self._entries.pop(conversation_id, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'conversations': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+            }
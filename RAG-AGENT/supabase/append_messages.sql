@@ -0,0 +1,56 @@
+-- Atomic message append used by ConversationManager.save_messages().
+-- Run once in the Supabase SQL editor (or `psql -f supabase/append_messages.sql`); safe to re-run.
+--
+-- One RPC call allocates message_index, inserts every message of the exchange and bumps
+-- the conversation's counters in a single transaction. The conversation row lock
+-- serializes concurrent writers, so two requests can no longer claim the same index.
+--
+-- Every message carries a client_id assigned by the backend when it is first saved.
+-- Messages whose client_id is already stored are skipped, so a write-behind flush that
+-- is retried after a lost response (or by a second flusher) never inserts twice.
+
+alter table public.messages add column if not exists client_id uuid;
+create unique index if not exists messages_client_id_key on public.messages (client_id);
+
+create or replace function public.append_messages(p_conversation_id uuid, p_messages jsonb)
+returns setof public.messages
+language plpgsql
+as $$
+declare
+    next_index integer;
+    inserted integer;
+begin
+    perform 1 from public.conversations where id = p_conversation_id for update;
+
+    select coalesce(max(message_index) + 1, 0) into next_index
+      from public.messages
+     where conversation_id = p_conversation_id;
+
+    return query
+    insert into public.messages
+        (conversation_id, client_id, role, content, message_index, query_type, web_results, rag_context, ai_response)
+    select p_conversation_id, m.client_id, m.role, m.content,
+           next_index + (row_number() over (order by m.ord))::integer - 1,
+           m.query_type, m.web_results, m.rag_context, m.ai_response
+      from rows from (jsonb_to_recordset(p_messages)
+               as (client_id uuid, role text, content text, query_type text, web_results jsonb,
+                   rag_context text, ai_response text))
+           with ordinality as m(client_id, role, content, query_type, web_results, rag_context, ai_response, ord)
+     where m.client_id is null
+        or not exists (select 1 from public.messages x where x.client_id = m.client_id)
+     order by m.ord
+    returning *;
+
+    get diagnostics inserted = row_count;
+    if inserted > 0 then
+        update public.conversations
+           set total_messages = next_index + inserted,
+               last_message_at = now()
+         where id = p_conversation_id;
+    end if;
+end;
+$$;
+
+-- Makes the max(message_index) lookup above an index-only read
+create index if not exists messages_conversation_index_idx
+    on public.messages (conversation_id, message_index);
@@ -0,0 +1,32 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chunker import TokenChunker  # noqa: E402
+
+LONG_SENTENCE = "The quick brown fox jumps over the lazy dog near the river bank today."
+
+
+def test_short_last_window_is_kept():
+    text = f"{LONG_SENTENCE} Tail end."
+    chunks = list(TokenChunker(chunk_tokens=16, overlap_tokens=0).iter_chunks(text))
+
+    assert [c['text'] for c in chunks] == [LONG_SENTENCE, "Tail end."]
+    assert len(chunks[-1]['text']) < 20
+    assert text[chunks[-1]['start']:chunks[-1]['end']] == "Tail end."
+
+
+def test_short_window_before_oversize_sentence_is_kept():
+    oversize = " ".join(["word"] * 40) + "."
+    chunks = list(TokenChunker(chunk_tokens=16, overlap_tokens=0).iter_chunks(f"Hi there. {oversize}"))
+
+    assert chunks[0]['text'] == "Hi there."
+    assert sum(c['text'].count("word") for c in chunks[1:]) == 40
+
+
+def test_every_sentence_lands_in_a_chunk():
+    sentences = [f"Sentence number {i} says something." for i in range(30)] + ["End."]
+    chunks = list(TokenChunker(chunk_tokens=24, overlap_tokens=6).iter_chunks(" ".join(sentences)))
+
+    text = " ".join(c['text'] for c in chunks)
+    assert all(sentence in text for sentence in sentences)
@@ -0,0 +1,67 @@
+"""
+Bounded TTL cache of email -> users row.
+The mapping practically never changes, so ConversationManager looks users up here first and
+only goes to Supabase on a miss. "No such user" is cached too, for a shorter time, so
+listing conversations for an unknown email doesn't query on every poll.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+USER_CACHE_TTL_SECONDS = float(os.getenv('USER_CACHE_TTL_SECONDS', '600'))
+USER_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv('USER_CACHE_NEGATIVE_TTL_SECONDS', '30'))
+USER_CACHE_MAX_ENTRIES = int(os.getenv('USER_CACHE_MAX_ENTRIES', '10000'))
+
+
+class UserCache:
+    def __init__(self, ttl_seconds=USER_CACHE_TTL_SECONDS, negative_ttl_seconds=USER_CACHE_NEGATIVE_TTL_SECONDS,
+                 max_entries=USER_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # {email: (user row or None, expires_at)}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, email):
+        """(True, row) on a hit, where row is None for a cached "not found"; (False, None) on a miss"""
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[email]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(email)
+            self.hits += 1
+            return True, entry[0]
+
+    def put(self, email, user):
+        ttl = self.ttl_seconds if user else self.negative_ttl_seconds
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[email] = (user, time.monotonic() + ttl)
+            self._entries.move_to_end(email)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, email=None):
+        """Forget one email, or everything when email is None"""
+        with self._lock:
+            if email is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(email, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+            }